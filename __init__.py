@@ -1,9 +1,30 @@
+import importlib
 
-from .arguments import ChoptArguments
-from .utils import hyperopt_run, human_report_hyperopt
-from .chopt import ContinuousHyperOpt
-from .chopt import start_continuous_hyperopt
-from .data_load import start_data_load
-from .trend import start_trend
+# Public names and their modules, imported on first access so that a command
+# loads only its own dependencies
+_EXPORTS = {
+    'ChoptArguments': '.arguments',
+    'hyperopt_run': '.utils',
+    'human_report_hyperopt': '.utils',
+    'ContinuousHyperOpt': '.chopt',
+    'start_continuous_hyperopt': '.chopt',
+    'start_data_load': '.data_load',
+    'start_trend': '.trend',
+    'start_hyperopt_scheduler': '.scheduler',
+    'start_chopt_daemon': '.daemon',
+    'start_hyperopt_worker': '.distributed',
+    'start_param_service': '.param_service',
+    'ParamClient': '.param_service',
+    'start_pipeline': '.pipeline',
+    'start_command': '.commands',
+}
 
+__all__ = list(_EXPORTS)
 
+
+def __getattr__(name):
+    if name in _EXPORTS:
+        value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -25,9 +25,19 @@ ARGS_COMMON = ["verbosity", "logfile", "version",
                "pairs_file", "days", "new_pairs_days",
                "download_trades", "exchange", "timeframes", "erase",
                "dataformat_trades", "strategy", "strategy_path",
-               "backperiod", "process"
+               "backperiod", "process", "jobs_file"
                ]
 
+ARGS_BASE = ["verbosity", "logfile", "version", "config", "datadir", "user_data_dir", "backperiod", "process"]
+
+# Options of processes which don't need the whole ARGS_COMMON set
+ARGS_PROCESS = {
+    "data_load": ARGS_BASE + ["timeframe", "timerange", "dataformat_ohlcv", "pairs", "pairs_file", "days",
+                              "new_pairs_days", "download_trades", "exchange", "timeframes", "erase",
+                              "dataformat_trades"],
+    "trend": ARGS_BASE + ["timeframe", "timerange", "dataformat_ohlcv", "pairs"],
+}
+
 NO_CONF_REQURIED = ["convert-data", "convert-trade-data", "download-data", "list-timeframes",
                     "list-markets", "list-pairs", "list-strategies", "list-data",
                     "list-hyperopts", "hyperopt-list", "hyperopt-show",
@@ -51,6 +61,13 @@ AVAILABLE_CLI_OPTIONS.update({
                 metavar='STR',
             ),
 
+            "jobs_file": Arg(
+                '--jobs-file',
+                help='JSON file with a list of hyperopt jobs, '
+                     'e.g. [{"config": ["config.json"], "strategy": "MyStrategy"}]',
+                metavar='PATH',
+            ),
+
         })
 
 
@@ -89,10 +106,15 @@ class ChoptArguments(Arguments):
         Builds and attaches all subcommands.
         :return: None
         """
+        # Build arguments of the selected process only
+        _process_parser = argparse.ArgumentParser(add_help=False)
+        self._build_args(optionlist=["process"], parser=_process_parser)
+        process = _process_parser.parse_known_args(self.args)[0].process
+
         # Build shared arguments (as group Common Options)
         _common_parser = argparse.ArgumentParser(add_help=False)
         group = _common_parser.add_argument_group("Common arguments")
-        self._build_args(optionlist=ARGS_COMMON, parser=group)
+        self._build_args(optionlist=ARGS_PROCESS.get(process, ARGS_COMMON), parser=group)
 
         self.parser = _common_parser
 
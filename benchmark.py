@@ -0,0 +1,365 @@
+"""
+Benchmarks of chopt hot paths on synthetic data, results are printed as json to compare versions.
+Usage: python -m <package>.benchmark {imports,results,storage,trend,data_load,loss,all}
+                                    [--baseline FILE] [--save-baseline FILE]
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from .commands import COMMANDS
+
+
+PACKAGE = __package__ or os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules which must not be loaded just by importing the package
+HEAVY_MODULES = ['prophet', 'pandas', 'pickledb', 'freqtrade.optimize.hyperopt', 'freqtrade.data.history']
+
+_IMPORT_SCRIPT = '''
+import json, sys, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(json.dumps({{'seconds': elapsed, 'loaded': [m for m in {heavy!r} if m in sys.modules]}}))
+'''
+
+
+def import_time(module: str, repeat: int = 3) -> Dict[str, Any]:
+    """
+    Import time of a module in a fresh interpreter, best of repeats
+    """
+    package_parent = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    best = None
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', _IMPORT_SCRIPT.format(module=module, heavy=HEAVY_MODULES)],
+                             cwd=package_parent, capture_output=True, text=True, check=True).stdout
+        res = json.loads(out.strip().splitlines()[-1])
+        if best is None or res['seconds'] < best['seconds']:
+            best = res
+    return best
+
+
+def benchmark_imports(repeat: int = 3) -> Dict[str, Dict[str, Any]]:
+    """
+    Import time of the package and of every command module
+    """
+    results = {PACKAGE: import_time(PACKAGE, repeat)}
+    for module_name, _ in COMMANDS.values():
+        module = f'{PACKAGE}{module_name}'
+        results[module] = import_time(module, repeat)
+    return results
+
+
+def measure(func: Callable, repeat: int = 1) -> Dict[str, Any]:
+    """
+    Best time of func over repeats, and peak traced memory of a separate run,
+    tracemalloc slows down allocations and would distort timings
+    """
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        if best is None or elapsed < best:
+            best = elapsed
+
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'seconds': best, 'peak_memory_bytes': peak}
+
+
+def synthetic_candles(count: int, timeframe_minutes: int = 5, seed: int = 0):
+    """
+    Random walk OHLCV candles ending at the last closed candle
+    """
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    end = pd.Timestamp.now(tz='UTC').floor(f'{timeframe_minutes}min') - pd.Timedelta(minutes=timeframe_minutes)
+    dates = pd.date_range(end=end, periods=count, freq=f'{timeframe_minutes}min')
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.002, count)))
+    open_ = np.concatenate([[close[0]], close[:-1]])
+    spread = np.abs(rng.normal(0, 0.001, count)) * close
+    return pd.DataFrame({
+        'date': dates,
+        'open': open_,
+        'high': np.maximum(open_, close) + spread,
+        'low': np.minimum(open_, close) - spread,
+        'close': close,
+        'volume': rng.uniform(1, 100, count),
+    })
+
+
+def write_synthetic_results(path: Path, epochs: int, seed: int = 0) -> None:
+    """
+    Hyperopt results file with realistic size of results_metrics per epoch
+    """
+    rnd = random.Random(seed)
+    best_loss = None
+    with path.open('w') as f:
+        for epoch in range(1, epochs + 1):
+            loss = rnd.uniform(-10, 10)
+            is_best = best_loss is None or loss < best_loss
+            best_loss = loss if is_best else best_loss
+            params = {f'buy_param_{i}': rnd.randint(0, 100) for i in range(10)}
+            params.update({f'roi_t{i}': rnd.randint(0, 120) for i in range(1, 4)})
+            metrics = {f'metric_{i}': rnd.random() for i in range(200)}
+            metrics['trades'] = [{'pair': 'BTC/USD', 'profit_ratio': rnd.uniform(-0.05, 0.05),
+                                  'open_date': '2021-01-01 00:00:00+00:00'} for _ in range(50)]
+            f.write(json.dumps({
+                'loss': loss, 'current_epoch': epoch, 'is_initial_point': epoch < 30, 'is_random': False,
+                'is_best': is_best, 'params_dict': params,
+                'params_details': {'buy': params}, 'results_metrics': metrics,
+                'results_explanation': '', 'total_profit': 0,
+            }) + '\n')
+
+
+def benchmark_results(repeat: int = 3, epochs: int = 2000) -> Dict[str, Dict[str, Any]]:
+    """
+    Best epoch extraction from a hyperopt results file
+    """
+    from .utils import read_hyperopt_results
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp, 'results.fthypt')
+        write_synthetic_results(path, epochs)
+        return {
+            f'best_epoch_{epochs}': measure(lambda: read_hyperopt_results(path), repeat),
+            f'best_epoch_top10_{epochs}': measure(lambda: read_hyperopt_results(path, top_trials=10), repeat),
+        }
+
+
+def benchmark_storage(repeat: int = 3, points: int = 20520, pairs: int = 20) -> Dict[str, Dict[str, Any]]:
+    """
+    ModelStorage save/load of params, position sizes and trend series
+    """
+    import numpy as np
+    from .model_storage import ModelStorage
+
+    params = {'default': {f'param_{i}': i for i in range(50)}}
+    params['default']['minimal_roi'] = {0: 0.1, 30: 0.05, 120: 0}
+    dates = np.arange(points, dtype=np.int64) * 300 + 1600000000
+    values = np.linspace(100, 200, points)
+    legacy = {datetime.datetime.utcfromtimestamp(int(d)).isoformat(): float(v) for d, v in zip(dates, values)}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        ms = ModelStorage(tmp)
+        pos_sizes = {f'pos_size_trend.pair{i}': {'pos_size': 0.5, 'forecast_date': '2021-01-01T00:00:00'}
+                     for i in range(pairs)}
+        results = {
+            'save_param': measure(lambda: ms.save('bot.strategy.param', params), repeat),
+            'load_param': measure(lambda: ms.load('bot.strategy.param'), repeat),
+            f'save_many_pos_size_{pairs}': measure(lambda: ms.save_many(pos_sizes), repeat),
+            f'save_trend_dict_{points}': measure(lambda: ms.save('trend_dict.pair', legacy), repeat),
+            f'load_trend_dict_{points}': measure(lambda: ms.load('trend_dict.pair'), repeat),
+        }
+
+        def rewrite_series():
+            values[0] += 1
+            ms.save_series('trend_forecast.pair', dates, values)
+
+        results[f'save_trend_series_{points}'] = measure(rewrite_series, repeat)
+        results['load_trend_series_last_1000'] = measure(
+            lambda: np.asarray(ms.load_series('trend_forecast.pair', 1000)[1]).sum(), repeat)
+        return results
+
+
+def benchmark_trend(repeat: int = 1, candles: int = 20520) -> Dict[str, Dict[str, Any]]:
+    """
+    Trend forecast (Prophet fit and position sizing) of a pair
+    """
+    from .trend import Trend
+
+    df = synthetic_candles(candles + 288)
+    with tempfile.TemporaryDirectory() as tmp:
+        config = {'bot_name': 'bench', 'timeframe': '5m', 'pairs': ['BTC/USD'], 'datadir': tmp,
+                  'user_data_dir': Path(tmp), 'candle_cache': False, 'chopt_metrics': False}
+        trend = Trend({'config': [], 'backperiod': candles}, config=config)
+        trend.load_candles = lambda pair: df.copy()
+
+        results = {}
+        for resample in (None, '1h'):
+            def forecast():
+                # New storage every time, so fit is not skipped as data is unchanged
+                trend.config['user_data_dir'] = Path(tempfile.mkdtemp(dir=tmp))
+                trend.forecast('BTC/USD')
+
+            trend.trend_resample = resample
+            results[f'forecast_{resample or "5m"}_{candles}'] = measure(forecast, repeat)
+        return results
+
+
+def _stub_download(download_args: Dict[str, Any]) -> None:
+    """
+    Downloader stub: fixed latency, pairs named FAIL/* always fail
+    """
+    time.sleep(0.05)
+    if download_args['pairs'][0].startswith('FAIL'):
+        raise ValueError('Stub download failed')
+
+
+def benchmark_data_load(repeat: int = 1, pairs: int = 40) -> Dict[str, Dict[str, Any]]:
+    """
+    DataDownload.load_data with stubbed downloader
+    """
+    from .data_load import DataDownload
+
+    results = {}
+    for workers in (1, 4):
+        with tempfile.TemporaryDirectory() as tmp:
+            config = {'bot_name': 'bench', 'timeframe': '5m', 'user_data_dir': tmp, 'datadir': tmp,
+                      'pairs': [f'PAIR{i}/USD' for i in range(pairs)] + ['FAIL/USD'],
+                      'download_workers': workers, 'download_retries': 1, 'download_backoff': 0,
+                      'candle_cache': False, 'chopt_metrics': False}
+
+            def load_data():
+                dd = DataDownload({'config': []}, downloader=_stub_download, config=dict(config))
+                dd.storage.save(dd.checkpoint_key, {})
+                dd.checkpoint = {}
+                dd.load_data()
+
+            results[f'load_data_{pairs}_pairs_{workers}_workers'] = measure(load_data, repeat)
+    return results
+
+
+def synthetic_trades(count: int, min_date, max_date, rng):
+    import numpy as np
+    import pandas as pd
+
+    close_date = min_date + pd.to_timedelta(rng.uniform(0, (max_date - min_date).total_seconds(), count), unit='s')
+    return pd.DataFrame({
+        'close_date': pd.DatetimeIndex(close_date).floor('5min'),
+        'profit_ratio': rng.normal(0.002, 0.02, count),
+    })
+
+
+def benchmark_loss(repeat: int = 3, epochs: int = 200, trades: int = 300,
+                   days: int = 30) -> Dict[str, Dict[str, Any]]:
+    """
+    Stock SortinoHyperOptLossDaily against chopt's vectorized version on the same epochs,
+    max_abs_diff of their losses is checked by check_regressions
+    """
+    import numpy as np
+    import pandas as pd
+    from freqtrade.optimize.hyperopt_loss_sortino_daily import SortinoHyperOptLossDaily
+    from .hyperopt_loss import ChoptSortinoHyperOptLossDaily
+
+    rng = np.random.default_rng(0)
+    max_date = pd.Timestamp('2021-06-01 13:10', tz='UTC')
+    min_date = max_date - pd.Timedelta(days=days, hours=5)
+    epoch_results = [synthetic_trades(int(n), min_date, max_date, rng)
+                     for n in rng.integers(0, trades, epochs)]
+
+    losses = {}
+    results = {}
+    for name, loss in (('stock', SortinoHyperOptLossDaily), ('chopt', ChoptSortinoHyperOptLossDaily)):
+        def run():
+            losses[name] = [loss.hyperopt_loss_function(df.copy(), len(df), min_date.to_pydatetime(),
+                                                        max_date.to_pydatetime()) for df in epoch_results]
+        results[f'{name}_sortino_daily_{epochs}_epochs'] = measure(run, repeat)
+
+    results[f'chopt_sortino_daily_{epochs}_epochs']['max_abs_diff'] = float(
+        np.max(np.abs(np.array(losses['stock']) - np.array(losses['chopt']))))
+    return results
+
+
+SUITES = {
+    'imports': benchmark_imports,
+    'results': benchmark_results,
+    'storage': benchmark_storage,
+    'trend': benchmark_trend,
+    'data_load': benchmark_data_load,
+    'loss': benchmark_loss,
+}
+
+# Max difference of chopt losses from the stock ones
+LOSS_TOLERANCE = 1e-9
+
+
+def check_imports(results: Dict[str, Dict[str, Any]], baseline: Optional[Dict[str, Dict[str, Any]]] = None,
+                  tolerance: float = 0.25) -> List[str]:
+    """
+    :return: list of regressions: heavy modules loaded by package import, imports slower than baseline
+    """
+    errors = []
+    if results[PACKAGE]['loaded']:
+        errors.append(f'Importing {PACKAGE} loads {results[PACKAGE]["loaded"]}')
+
+    for module, res in (baseline or {}).items():
+        if module in results and results[module]['seconds'] > res['seconds'] * (1 + tolerance):
+            errors.append(f'{module} import takes {results[module]["seconds"]:.3f}s, '
+                          f'baseline {res["seconds"]:.3f}s')
+    return errors
+
+
+def check_regressions(results: Dict[str, Dict[str, Dict[str, Any]]],
+                      baseline: Optional[Dict[str, Dict[str, Dict[str, Any]]]] = None,
+                      tolerance: float = 0.25) -> List[str]:
+    """
+    :return: list of cases slower than baseline, import errors and loss mismatches
+    """
+    errors = []
+    if 'imports' in results:
+        errors += check_imports(results['imports'], (baseline or {}).get('imports'), tolerance)
+
+    for case, res in results.get('loss', {}).items():
+        if res.get('max_abs_diff', 0) > LOSS_TOLERANCE:
+            errors.append(f'loss {case} differs from stock loss by {res["max_abs_diff"]}')
+
+    for suite, cases in (baseline or {}).items():
+        if suite == 'imports' or suite not in results:
+            continue
+        for case, res in cases.items():
+            if case in results[suite] and results[suite][case]['seconds'] > res['seconds'] * (1 + tolerance):
+                errors.append(f'{suite} {case} takes {results[suite][case]["seconds"]:.3f}s, '
+                              f'baseline {res["seconds"]:.3f}s')
+    return errors
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='chopt benchmarks')
+    parser.add_argument('suite', choices=[*SUITES, 'all'])
+    parser.add_argument('--repeat', type=int, default=None, help='Repeats, best result is reported')
+    parser.add_argument('--baseline', help='Fail if results are worse than baseline json')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--save-baseline', help='Save results as baseline json')
+    args = parser.parse_args(argv)
+
+    suites = list(SUITES) if args.suite == 'all' else [args.suite]
+    results = {}
+    for suite in suites:
+        kwargs = {'repeat': args.repeat} if args.repeat else {}
+        results[suite] = SUITES[suite](**kwargs)
+    print(json.dumps(results, indent=2))
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    errors = check_regressions(results, baseline, args.tolerance)
+    for error in errors:
+        print(error, file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
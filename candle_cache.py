@@ -0,0 +1,164 @@
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from freqtrade.configuration import TimeRange
+from freqtrade.data.history import load_pair_history
+from freqtrade.data.history.idatahandler import get_datahandler
+from freqtrade.exceptions import OperationalException
+from freqtrade.exchange import timeframe_to_seconds
+from freqtrade.misc import pair_to_filename
+
+from .instrumentation import metrics
+
+
+logger = logging.getLogger(__name__)
+
+OHLCV_COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+
+
+def datadir_key(datadir) -> str:
+    """
+    Cache folder name of a data directory, data of different exchanges or bots don't share a cache
+    """
+    path = Path(datadir).resolve()
+    return f'{path.name}-{hashlib.sha1(str(path).encode()).hexdigest()[:10]}'
+
+
+class CandleCache:
+    """
+    Local cache of OHLCV candles in memory-mappable columnar layout per (pair, timeframe).
+    Candles are converted from freqtrade data files once, processes reading the cache
+    share the same pages instead of parsing data files and holding their own copies.
+    Cache is invalidated when data file mtime or size changes, each data directory has its own cache.
+    """
+
+    def __init__(self, root_folder, datadir, data_format: str = 'json') -> None:
+        self.datadir = Path(datadir)
+        self.root = Path(root_folder, 'chopt_cache', 'candles', datadir_key(self.datadir))
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+        self.data_format = data_format
+        self.data_handler = get_datahandler(self.datadir, data_format)
+
+    def cache_path(self, pair: str, timeframe: str, column: str) -> Path:
+        return self.root.joinpath(f'{pair_to_filename(pair)}-{timeframe}.{column}')
+
+    def data_file_stat(self, pair: str, timeframe: str) -> Optional[Dict[str, int]]:
+        path = self.data_handler._pair_data_filename(self.datadir, pair, timeframe)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return {'mtime': st.st_mtime_ns, 'size': st.st_size}
+
+    def _read_meta(self, pair: str, timeframe: str) -> Dict:
+        try:
+            with self.cache_path(pair, timeframe, 'meta.json').open('r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def refresh(self, pair: str, timeframe: str) -> bool:
+        """
+        Convert pair data file to cache if cache is missing or outdated
+        :return: True if cache is up to date
+        """
+        stat = self.data_file_stat(pair, timeframe)
+        if stat is None:
+            return False
+        meta = self._read_meta(pair, timeframe)
+        if meta.get('source') == stat:
+            return True
+
+        with metrics.stage('candle_cache_convert', pair=pair, timeframe=timeframe):
+            df = load_pair_history(datadir=self.datadir, timeframe=timeframe, pair=pair,
+                                   data_format=self.data_format)
+        if df.empty:
+            return False
+
+        dates = df['date'].to_numpy().astype('datetime64[s]').astype(np.int64)
+        ohlcv = np.ascontiguousarray(df[OHLCV_COLUMNS].to_numpy(dtype=np.float64).T)
+
+        # Data files first, meta last, so readers never see meta of unfinished data
+        for column, arr in (('dates', dates), ('ohlcv', ohlcv)):
+            path = self.cache_path(pair, timeframe, f'{column}.npy')
+            tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+            with tmp_path.open('wb') as f:
+                np.save(f, arr)
+            os.replace(tmp_path, path)
+
+        meta = {'source': stat, 'length': len(dates), 'last_candle': int(dates[-1])}
+        meta_path = self.cache_path(pair, timeframe, 'meta.json')
+        tmp_path = meta_path.with_name(f'{meta_path.name}.{os.getpid()}.tmp')
+        with tmp_path.open('w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+        logger.debug(f'Candle cache for {pair} {timeframe} updated, {len(dates)} candles')
+        return True
+
+    def load_arrays(self, pair: str, timeframe: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Memory-mapped candles, no data is copied
+        :return: (int64 epoch seconds dates, float64 array of open, high, low, close, volume rows)
+        """
+        for _ in range(3):
+            if not self.refresh(pair, timeframe):
+                break
+            meta = self._read_meta(pair, timeframe)
+            dates = np.load(self.cache_path(pair, timeframe, 'dates.npy'), mmap_mode='r')
+            ohlcv = np.load(self.cache_path(pair, timeframe, 'ohlcv.npy'), mmap_mode='r')
+            # Files may have been replaced between reads
+            if len(dates) == meta.get('length') == ohlcv.shape[1]:
+                return dates, ohlcv
+
+        return np.empty(0, dtype=np.int64), np.empty((len(OHLCV_COLUMNS), 0), dtype=np.float64)
+
+    @staticmethod
+    def to_dataframe(dates: np.ndarray, ohlcv: np.ndarray) -> pd.DataFrame:
+        """
+        Candles as a dataframe like freqtrade's load_pair_history returns. OHLCV columns are views
+        of the arrays, dates are converted from epoch seconds to a new datetime column.
+        """
+        df = pd.DataFrame({column: ohlcv[i] for i, column in enumerate(OHLCV_COLUMNS)}, copy=False)
+        df.insert(0, 'date', pd.to_datetime(dates, unit='s', utc=True))
+        return df
+
+    def load(self, pair: str, timeframe: str) -> pd.DataFrame:
+        """
+        All candles of pair as a dataframe, see to_dataframe()
+        """
+        return self.to_dataframe(*self.load_arrays(pair, timeframe))
+
+    def load_data(self, pairs: List[str], timeframe: str, timerange: Optional[TimeRange] = None,
+                  startup_candles: int = 0, fail_without_data: bool = True) -> Dict[str, pd.DataFrame]:
+        """
+        Candles of pairs within timerange, drop-in for freqtrade's history.load_data.
+        Timerange is selected by slicing the memory-mapped arrays, see to_dataframe()
+        """
+        start = end = None
+        if timerange is not None:
+            if timerange.starttype == 'date':
+                start = timerange.startts - startup_candles * timeframe_to_seconds(timeframe)
+            if timerange.stoptype == 'date':
+                end = timerange.stopts
+
+        result = {}
+        for pair in pairs:
+            dates, ohlcv = self.load_arrays(pair, timeframe)
+            first = int(np.searchsorted(dates, start, side='left')) if start is not None else 0
+            last = int(np.searchsorted(dates, end, side='right')) if end is not None else len(dates)
+            if first >= last:
+                logger.warning(f'No history data for pair: "{pair}", timeframe: {timeframe}.')
+                continue
+            result[pair] = self.to_dataframe(dates[first:last], ohlcv[:, first:last])
+
+        if fail_without_data and not result:
+            raise OperationalException("No data found. Terminating.")
+        return result
@@ -1,5 +1,5 @@
 import logging
-from typing import Any, Dict
+from typing import Any, Dict, List
 
 from pprint import pprint
 from freqtrade.exchange import timeframe_to_minutes, timeframe_to_prev_date
@@ -8,6 +8,7 @@ from freqtrade.enums import RunMode
 
 from .utils import hyperopt_run, setup_chopt_configuration, human_report_hyperopt
 from .model_storage import ModelStorage
+from .candle_cache import CandleCache
 
 
 logger = logging.getLogger(__name__)
@@ -22,7 +23,6 @@ def start_continuous_hyperopt(args: Dict[str, Any]) -> None:
     logger.info('Starting continuous hyperopt...')
 
     chopt = ContinuousHyperOpt(args)
-    chopt.hyperopt_epochs = 900
     chopt.hyperopt_jobs = 4
     chopt.run_hyperopt()
 
@@ -43,12 +43,21 @@ class ContinuousHyperOpt:
         self.pair_list = self.config["pairs"]
         self.data_dir = self.config['datadir']
 
-        self.name = f'{self.bot_name} {self.strategy}'
+        # Per pair mode: optimize pairs (or groups of pairs) separately and save params under pair keys
+        self.per_pair = args.get('chopt_per_pair', self.config.get('chopt_per_pair', False))
+        self.pair_groups = self.config.get('chopt_pair_groups', None)
+        self.job_name = args.get('chopt_job', '')
+
+        self.name = f'{self.bot_name} {self.strategy}' + (f' {self.job_name}' if self.job_name else '')
         self.hyperopt_loss = 'SortinoHyperOptLossDaily'
 
-        end_date = timeframe_to_prev_date(self.timeframe)
-        start_date = end_date - datetime.timedelta(minutes=self.back_period * timeframe_to_minutes(self.timeframe))
-        self.timerange_str = f'{start_date.strftime("%Y%m%d")}-{end_date.strftime("%Y%m%d")}'
+        # Held-out trailing candles to validate new params on before they are published,
+        # hyperopt runs on the rest of back period
+        # Held-out candles are cut from the end of the hyperopt window, off unless configured
+        self.validation_period = self.config.get('chopt_validation_period', 0)
+        self.validation_margin = self.config.get('chopt_validation_margin', 0.0)
+
+        self.update_timerange()
 
         self.dry_run_wallet = 1000
         self.hyperopt_spaces = ['buy', 'sell', 'roi']
@@ -58,19 +67,119 @@ class ContinuousHyperOpt:
         self.hyperopt_min_trades = 5
         self.hyperopt_jobs = 8
 
+        # Stop when best loss hasn't improved by more than epsilon over patience epochs,
+        # or when time budget (seconds) is over
+        self.early_stop_patience = self.config.get('early_stop_patience', 150)
+        self.early_stop_epsilon = self.config.get('early_stop_epsilon', 1e-4)
+        self.hyperopt_time_budget = self.config.get('hyperopt_time_budget', None)
+
+        # Warm start from previous run's best params and top trials
+        self.warm_start = True
+        self.warm_start_trials = 10
+        self.warm_start_epochs = 300
+
+        # Reuse indicator frames of the previous run, calculate appended candles only
+        self.indicator_cache = True
+
+        # Read candles from the cache shared with data load and trend
+        self.candle_cache = True
+
+        # Distributed mode: this process coordinates, epochs are evaluated by hyperopt workers
+        # (--process worker) on other hosts sharing the task queue. Points asked per optimizer step
+        # are spread over the workers, local cores evaluate batches not claimed by workers yet.
+        self.distributed = self.config.get('chopt_distributed', False)
+        self.distributed_epochs_per_step = self.config.get('chopt_distributed_epochs_per_step', 32)
+
+        # Keep hyperopt config and instance (strategy, caches) between runs
+        self.keep_alive = False
+        self.hyperopt_config = None
+        self.hyperopt = None
+
         logger.info(f'Instantiated chopt for {self.name}, timerange {self.timerange_str}')
 
-    def save_opted_params(self, params_dict: Dict[str, Any]) -> None:
+    def update_timerange(self) -> None:
+        end_date = timeframe_to_prev_date(self.timeframe)
+        start_date = end_date - datetime.timedelta(minutes=self.back_period * timeframe_to_minutes(self.timeframe))
+        self.timerange_str = f'{start_date.strftime("%Y%m%d")}-{end_date.strftime("%Y%m%d")}'
+
+        if self.validation_period:
+            validation_start = end_date - datetime.timedelta(
+                minutes=self.validation_period * timeframe_to_minutes(self.timeframe))
+            self.validation_start = int(validation_start.timestamp())
+            self.timerange_str = f'{int(start_date.timestamp())}-{self.validation_start}'
+            self.validation_timerange_str = f'{int(start_date.timestamp())}-{int(end_date.timestamp())}'
+
+    def load_params(self) -> Dict[str, Any]:
         ms = ModelStorage(self.config['user_data_dir'])
-        ms.save(f'{self.bot_name}.{self.strategy}.param', params_dict)
+        return ms.load(f'{self.bot_name}.{self.strategy}.param')
 
-    def run_hyperopt(self):
+    def publishable_params(self, params_json: Dict[str, Any]) -> Dict[str, Any]:
         """
-        Start hyperopt process
+        Walk-forward check: backtest new and currently deployed params on the held-out segment,
+        new params are published only if they beat deployed ones by validation margin,
+        with equal losses new params are published.
+        Params saved under pair keys are validated on the pair's candles against the pair's deployed params.
+        :return: params allowed to publish
         """
+        deployed = self.load_params()
+        processed, validation_range = self.hyperopt.validation_data(self.validation_timerange_str,
+                                                                     self.validation_start)
+
+        allowed = {}
+        for key, params in params_json.items():
+            incumbent = deployed.get(key)
+            candidates = [params] + ([incumbent] if incumbent else [])
+            if key == 'default':
+                pair_processed = processed
+            else:
+                pair_processed = {key: processed[key]} if key in processed else {}
+
+            losses = self.hyperopt.validate(candidates, pair_processed, validation_range)
+            if not losses:
+                logger.warning(f'No validation data for {key}, params not published. {self.name}')
+                continue
+            if not incumbent:
+                logger.info(f'Validation loss of {key} {losses[0]:.5f}, no params deployed yet. {self.name}')
+                allowed[key] = params
+                continue
+
+            publish = losses[0] + self.validation_margin <= losses[1]
+            logger.info(f'Validation loss of {key} {losses[0]:.5f}, deployed params loss {losses[1]:.5f}, '
+                        f'new params {"published" if publish else "rejected"}. {self.name}')
+            if publish:
+                allowed[key] = params
+        return allowed
 
-        logger.info(f'Loaded config for {self.name}, {len(self.pair_list)} pairs in whitelist')
+    def save_opted_params(self, params_dict: Dict[str, Any]) -> None:
+        """
+        Update params of given pairs ('default' or pair names), params of other pairs are kept
+        """
+        ms = ModelStorage(self.config['user_data_dir'])
+        key = f'{self.bot_name}.{self.strategy}.param'
+        with ms.transaction():
+            stored = ms.load(key)
+            stored.update(params_dict)
+            ms.save(key, stored)
+
+    def trials_key(self) -> str:
+        key = f'{self.bot_name}.{self.strategy}.trials'
+        return f'{key}_{self.job_name}' if self.job_name else key
+
+    def save_trials(self, trials: List[Dict[str, Any]]) -> None:
+        ms = ModelStorage(self.config['user_data_dir'])
+        ms.save(self.trials_key(), {
+            'timerange': self.timerange_str,
+            'trials': trials,
+        })
 
+    def load_trials(self) -> List[Dict[str, Any]]:
+        """
+        Params of the best epochs found by the previous run, best first
+        """
+        ms = ModelStorage(self.config['user_data_dir'])
+        return ms.load(self.trials_key()).get('trials', [])
+
+    def build_hyperopt_config(self, epochs: int) -> Dict[str, Any]:
         config = setup_chopt_configuration({
                 'hyperopt_loss': self.hyperopt_loss,
                 'strategy': self.strategy,
@@ -80,7 +189,7 @@ class ContinuousHyperOpt:
                 'dry_run_wallet': self.dry_run_wallet,
                 'dry_run': True,
                 'spaces': self.hyperopt_spaces,
-                'epochs': self.hyperopt_epochs,
+                'epochs': epochs,
                 'hyperopt_random_stat': self.hyperopt_random_stat,
                 'hyperopt_enable_protections': self.hyperopt_enable_protections,
                 'hyperopt_min_trades': self.hyperopt_min_trades,
@@ -90,8 +199,97 @@ class ContinuousHyperOpt:
         config['pairlists'] = [{'method': 'StaticPairList'}]
         config['dry_run'] = True
         config['runmode'] = RunMode.HYPEROPT
+        config['indicator_cache'] = self.indicator_cache
+        config['candle_cache'] = self.candle_cache
+        config['early_stop_patience'] = self.early_stop_patience
+        config['early_stop_epsilon'] = self.early_stop_epsilon
+        config['hyperopt_time_budget'] = self.hyperopt_time_budget
+        config['chopt_job'] = self.job_name
+
+        return config
+
+    def data_fingerprint(self, pair: str) -> str:
+        stat = CandleCache(self.config['user_data_dir'], self.data_dir,
+                           self.config.get('dataformat_ohlcv', 'json')).data_file_stat(pair, self.timeframe)
+        return f'{self.timerange_str} {stat["mtime"]} {stat["size"]}' if stat else ''
+
+    def run_per_pair(self) -> bool:
+        """
+        Optimize pairs or groups of pairs concurrently, each group with its own params.
+        Groups whose data haven't changed since the last optimization are skipped.
+        """
+        from .scheduler import HyperoptScheduler
+
+        ms = ModelStorage(self.config['user_data_dir'])
+        state_key = f'{self.bot_name}.{self.strategy}.param_state'
+        state = ms.load(state_key)
+
+        groups = self.pair_groups or {pair.replace('/', '').lower(): [pair] for pair in self.pair_list}
+        fingerprints = {pair: self.data_fingerprint(pair) for pairs in groups.values() for pair in pairs}
+
+        jobs = {}
+        for group, pairs in groups.items():
+            if all(fingerprints[pair] and state.get(pair) == fingerprints[pair] for pair in pairs):
+                logger.info(f'Data of {group} not changed, params are up to date')
+                continue
+            jobs[group] = {
+                'config': self.config_files,
+                'strategy': self.strategy,
+                'backperiod': self.back_period,
+                'pairs': pairs,
+                'chopt_job': group,
+                'chopt_per_pair': False,
+            }
+
+        if not jobs:
+            return True
 
-        hyperopt_res = hyperopt_run(config)
+        results = HyperoptScheduler(list(jobs.values()), cpu_count=self.config.get('hyperopt_jobs')).run()
+
+        with ms.transaction():
+            state = ms.load(state_key)
+            for res in results:
+                if res['ok']:
+                    for pair in groups[res['job']]:
+                        state[pair] = fingerprints[pair]
+            ms.save(state_key, state)
+
+        return all(res['ok'] for res in results)
+
+    def run_hyperopt(self):
+        """
+        Start hyperopt process
+        """
+        if self.per_pair:
+            return self.run_per_pair()
+
+        logger.info(f'Loaded config for {self.name}, {len(self.pair_list)} pairs in whitelist')
+
+        initial_params = self.load_trials() if self.warm_start else []
+        epochs = self.hyperopt_epochs
+        if initial_params:
+            epochs = min(epochs, self.warm_start_epochs)
+            logger.info(f'Warm start from {len(initial_params)} previous trials, {epochs} epochs')
+
+        if self.hyperopt_config is None or not self.keep_alive:
+            self.hyperopt_config = self.build_hyperopt_config(epochs)
+        config = self.hyperopt_config
+        config['timerange'] = self.timerange_str
+        config['epochs'] = epochs
+        config['hyperopt_jobs'] = self.hyperopt_jobs
+        if self.distributed:
+            config['chopt_distributed_epochs_per_step'] = self.distributed_epochs_per_step
+            config['chopt_coordinator_jobs'] = self.config.get('chopt_coordinator_jobs', self.hyperopt_jobs)
+
+        if self.hyperopt is None or not self.keep_alive:
+            if self.distributed:
+                from .distributed import DistributedHyperopt as Hyperopt
+            else:
+                from .optimizer import ChoptHyperopt as Hyperopt
+            self.hyperopt = Hyperopt(config, initial_params)
+
+        hyperopt_res = hyperopt_run(config, initial_params, self.warm_start_trials, self.hyperopt)
+        self.epochs_run = hyperopt_res.get('epochs_used', epochs)
 
         if not hyperopt_res.get('results_metrics', False):
             logger.error(f'Hyperopt finished, no results obtained')
@@ -119,9 +317,20 @@ class ContinuousHyperOpt:
                 min_roi[int(key)] = round(val, 3)
             params_json[pair]['minimal_roi'] = min_roi
 
+            # Job of per pair mode saves params under its pairs
+            if self.job_name:
+                params_json = {pair: params_json['default'] for pair in self.pair_list}
+
             logger.info(f'Parameters:\n{params_json}')
 
-        self.save_opted_params(params_json)
+            if self.validation_period:
+                params_json = self.publishable_params(params_json)
+
+        if params_json:
+            self.save_opted_params(params_json)
+
+        if hyperopt_res.get('top_trials'):
+            self.save_trials(hyperopt_res['top_trials'])
 
         return True
 
@@ -0,0 +1,37 @@
+"""
+Registry of chopt entry points. Modules of a command, with their heavy
+dependencies (freqtrade hyperopt, prophet, pandas), are imported only when
+the command is dispatched.
+"""
+import importlib
+from typing import Any, Callable, Dict
+
+from freqtrade.exceptions import OperationalException
+
+
+COMMANDS = {
+    'chopt': ('.chopt', 'start_continuous_hyperopt'),
+    'data_load': ('.data_load', 'start_data_load'),
+    'trend': ('.trend', 'start_trend'),
+    'scheduler': ('.scheduler', 'start_hyperopt_scheduler'),
+    'daemon': ('.daemon', 'start_chopt_daemon'),
+    'worker': ('.distributed', 'start_hyperopt_worker'),
+    'param_service': ('.param_service', 'start_param_service'),
+    'pipeline': ('.pipeline', 'start_pipeline'),
+}
+
+
+def get_command(name: str) -> Callable[[Dict[str, Any]], None]:
+    if name not in COMMANDS:
+        raise OperationalException(f'Unknown process "{name}", available: {", ".join(COMMANDS)}')
+    module_name, func_name = COMMANDS[name]
+    return getattr(importlib.import_module(module_name, __package__), func_name)
+
+
+def start_command(args: Dict[str, Any]) -> None:
+    """
+    Dispatch to entry point selected with --process
+    :param args: Cli args from Arguments()
+    :return: None
+    """
+    get_command(args['process'])(args)
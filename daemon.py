@@ -0,0 +1,95 @@
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict
+
+from freqtrade.exchange import timeframe_to_prev_date, timeframe_to_seconds
+
+from .chopt import ContinuousHyperOpt
+
+
+logger = logging.getLogger(__name__)
+
+
+def start_chopt_daemon(args: Dict[str, Any]) -> None:
+    """
+    Start continuous hyperopt as a long-running process
+    :param args: Cli args from Arguments()
+    :return: None
+    """
+    logger.info('Starting continuous hyperopt daemon...')
+
+    daemon = ChoptDaemon(args)
+    daemon.run()
+
+
+class ChoptDaemon:
+    """
+    Re-runs hyperopt after candle close, keeping configuration, strategy
+    and caches alive between runs. Config changes trigger a reload
+    and an immediate run.
+    """
+
+    def __init__(self, args: Dict[str, Any], poll_interval: float = 5.0) -> None:
+        self.args = args
+        self.poll_interval = poll_interval
+        self.chopt = None
+        self.config_mtimes = {}
+
+    def config_files_mtimes(self) -> Dict[str, float]:
+        mtimes = {}
+        for path in self.args['config']:
+            try:
+                mtimes[path] = os.stat(path).st_mtime
+            except OSError:
+                mtimes[path] = 0
+        return mtimes
+
+    def config_changed(self) -> bool:
+        return self.config_files_mtimes() != self.config_mtimes
+
+    def load(self) -> None:
+        self.config_mtimes = self.config_files_mtimes()
+        self.chopt = None
+        self.chopt = ContinuousHyperOpt(self.args)
+        self.chopt.keep_alive = True
+        self.schedule_timeframe = self.chopt.config.get('chopt_schedule_timeframe', self.chopt.timeframe)
+        self.schedule_delay = self.chopt.config.get('chopt_schedule_delay', 10)
+
+    def next_run_time(self) -> datetime:
+        """
+        Close of the current candle of schedule timeframe plus delay for data to arrive
+        """
+        return datetime.fromtimestamp(
+            timeframe_to_prev_date(self.schedule_timeframe).timestamp()
+            + timeframe_to_seconds(self.schedule_timeframe) + self.schedule_delay, tz=timezone.utc)
+
+    def wait(self, until: datetime) -> None:
+        """
+        Sleep until given time or config change
+        """
+        while datetime.now(timezone.utc) < until:
+            if self.config_changed():
+                logger.info('Config changed, reloading')
+                return
+            time.sleep(min(self.poll_interval, max(0.0, (until - datetime.now(timezone.utc)).total_seconds())))
+
+    def run_once(self) -> bool:
+        if self.chopt is None or self.config_changed():
+            self.load()
+        self.chopt.update_timerange()
+        return self.chopt.run_hyperopt()
+
+    def run(self) -> None:
+        while True:
+            started = time.time()
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.exception(f'Continuous hyperopt run failed: {e}')
+            logger.info(f'Continuous hyperopt run took {time.time() - started:.1f}s')
+
+            next_run = self.next_run_time()
+            logger.info(f'Next run at {next_run}')
+            self.wait(next_run)
@@ -1,14 +1,26 @@
+import gzip
 import logging
 import datetime
-from typing import Any, Dict
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional, Tuple
 from pathlib import Path
 import os.path
 
+import pandas as pd
+import rapidjson
 from freqtrade.exchange import timeframe_to_minutes, timeframe_to_prev_date
 from freqtrade.commands import start_download_data
 from freqtrade.misc import pair_to_filename
+from freqtrade.data.converter import clean_ohlcv_dataframe, ohlcv_to_dataframe
+from freqtrade.data.history.idatahandler import get_datahandler
+from freqtrade.resolvers import ExchangeResolver
 
 from .utils import setup_configuration
+from .model_storage import ModelStorage
+from .candle_cache import CandleCache
+from .instrumentation import metrics
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -29,12 +41,182 @@ def start_data_load(args: Dict[str, Any]) -> None:
         return
 
 
+def pair_trades_filename(datadir: Path, pair: str) -> Path:
+    file_extension = 'json.gz'
+    pair_s = pair_to_filename(pair)
+    filename = datadir.joinpath(f'{pair_s}-trades.{file_extension}')
+    return filename
+
+
+def repair_trades_file(path: Path) -> bool:
+    """
+    Truncate corrupt tail of trades file keeping all complete trades
+    :return: True if file is valid or has been repaired
+    """
+    raw = bytearray()
+    try:
+        with gzip.open(path, 'rb') as f:
+            while True:
+                chunk = f.read(1 << 20)
+                if not chunk:
+                    break
+                raw.extend(chunk)
+    except (EOFError, OSError, zlib.error):
+        pass
+
+    if not raw:
+        return False
+
+    try:
+        rapidjson.loads(raw)
+        return True
+    except ValueError:
+        pass
+
+    # Cut after the last complete trade and close the list
+    pos = len(raw)
+    for _ in range(100):
+        pos = raw.rfind(b'],', 0, pos)
+        if pos < 0:
+            return False
+        try:
+            trades = rapidjson.loads(raw[:pos + 1] + b']')
+        except ValueError:
+            continue
+        # Original file is kept if writing is interrupted
+        tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+        with gzip.open(tmp_path, 'wb') as f:
+            f.write(rapidjson.dumps(trades).encode())
+        os.replace(tmp_path, path)
+        logger.info(f'Trades file {path} repaired, {len(trades)} trades kept')
+        return True
+    return False
+
+
+def ohlcv_gaps(df: pd.DataFrame, timeframe: str,
+               start: datetime.datetime, end: datetime.datetime) -> List[Tuple[datetime.datetime, datetime.datetime]]:
+    """
+    Find missing candle ranges of stored data within start - end
+    :return: list of (first missing candle, last missing candle)
+    """
+    step = datetime.timedelta(minutes=timeframe_to_minutes(timeframe))
+    if df.empty:
+        return [(start, end)]
+
+    dates = df['date'][(df['date'] >= start) & (df['date'] <= end)].reset_index(drop=True)
+    if dates.empty:
+        return [(start, end)]
+
+    gaps = []
+    if dates.iloc[0] > start:
+        gaps.append((start, dates.iloc[0] - step))
+    for i in dates.index[dates.diff() > step]:
+        gaps.append((dates.iloc[i - 1] + step, dates.iloc[i] - step))
+    if dates.iloc[-1] < end:
+        gaps.append((dates.iloc[-1] + step, end))
+    return gaps
+
+
+def incremental_download(download_args: Dict[str, Any]) -> None:
+    """
+    Gap-aware OHLCV refresh, downloader compatible with start_download_data.
+    Fetches candles after the last stored one and merges them into the stored data.
+    Older gaps are fetched again up to data_gap_retries times, exchange may not have
+    these candles at all. Trades are downloaded by freqtrade.
+    """
+    config = setup_configuration(download_args)
+    if config.get('download_trades'):
+        start_download_data(download_args)
+        return
+
+    exchange = ExchangeResolver.load_exchange(config['exchange']['name'], config, validate=False)
+    data_handler = get_datahandler(Path(config['datadir']), config.get('dataformat_ohlcv', 'json'))
+    start_str, _ = download_args['timerange'].split('-')
+    start = datetime.datetime.strptime(start_str, '%Y%m%d').replace(tzinfo=datetime.timezone.utc)
+
+    gap_retries = config.get('data_gap_retries', 3)
+    ms = ModelStorage(config['user_data_dir'])
+
+    for pair in download_args['pairs']:
+        # State per pair, pairs are downloaded by concurrent workers.
+        # '<pair> <timeframe> <first missing candle>' -> fetch attempts of gaps before the last stored candle
+        state_key = f'{config["bot_name"]}.data_gaps.{pair.replace("/", "").lower()}'
+        attempts = ms.load(state_key)
+        stored_attempts = dict(attempts)
+
+        for timeframe in download_args['timeframes']:
+            end = timeframe_to_prev_date(timeframe)
+            data = data_handler.ohlcv_load(pair, timeframe, timerange=None, fill_missing=False,
+                                           drop_incomplete=False, warn_no_data=False)
+            gaps = ohlcv_gaps(data, timeframe, start, end)
+            prefix = f'{pair} {timeframe} '
+            tail = [gap for gap in gaps if gap[1] >= end]
+            retried = [gap for gap in gaps if gap[1] < end
+                       and attempts.get(f'{prefix}{gap[0].isoformat()}', 0) < gap_retries]
+            if not tail and not retried:
+                logger.info(f'{pair} {timeframe} is up to date' +
+                            (f', {len(gaps)} gaps not available on exchange' if gaps else ''))
+                continue
+
+            since = (retried or tail)[0][0]
+            new_data = exchange.get_historic_ohlcv(pair=pair, timeframe=timeframe,
+                                                   since_ms=int(since.timestamp() * 1000))
+            new_df = ohlcv_to_dataframe(new_data, timeframe, pair, fill_missing=False, drop_incomplete=True)
+            data = clean_ohlcv_dataframe(pd.concat([data, new_df]), timeframe, pair,
+                                         fill_missing=False, drop_incomplete=False)
+            data_handler.ohlcv_store(pair, timeframe, data=data)
+            logger.info(f'{pair} {timeframe}: {len(gaps)} gaps, {len(new_df)} candles fetched since {since}')
+
+            # Count attempts of gaps still missing, filled gaps are forgotten
+            remaining = [gap for gap in ohlcv_gaps(data, timeframe, start, end) if gap[1] < end]
+            for key in [key for key in attempts if key.startswith(prefix)]:
+                count = attempts.pop(key)
+                if any(key == f'{prefix}{gap[0].isoformat()}' for gap in remaining):
+                    attempts[key] = count
+            for gap in remaining:
+                key = f'{prefix}{gap[0].isoformat()}'
+                if gap[0] >= since:
+                    attempts[key] = attempts.get(key, 0) + 1
+
+        if attempts != stored_attempts:
+            ms.save(state_key, attempts)
+
+
+def download_pair(downloader: Callable, download_args: Dict[str, Any], data_file_name: Path,
+                  retries: int, backoff: float) -> bool:
+    """
+    Download data for one pair, retry with exponential backoff on errors
+    :param downloader: download function, freqtrade's start_download_data or a stub for testing
+    :return: True if data downloaded
+    """
+    pair = download_args['pairs'][0]
+    for i in range(retries + 1):
+        if i:
+            delay = backoff * 2 ** (i - 1)
+            logger.info(f"Data download for {pair} finished with error, retrying in {delay:.0f}s ({i})...")
+            time.sleep(delay)
+            if data_file_name.is_file() and not repair_trades_file(data_file_name):
+                logger.info(f"Trades file {data_file_name} can't be repaired, download from scratch")
+                try:
+                    os.remove(data_file_name)
+                except OSError:
+                    pass
+        try:
+            with metrics.stage('data_download_pair', pair=pair):
+                downloader(download_args)
+            return True
+        except (Exception, SystemExit) as e:
+            logger.error(f"Data download for {pair}: {e}")
+    return False
+
+
 class DataDownload:
 
-    def __init__(self, args: Dict[str, Any]) -> None:
+    def __init__(self, args: Dict[str, Any], downloader: Optional[Callable] = None,
+                 config: Optional[Dict[str, Any]] = None) -> None:
         self.config_files = args['config']
         self.back_period = args.get("backperiod", 864)
-        self.config = setup_configuration(args)
+        self.config = config if config is not None else setup_configuration(args)
 
         self.config['dry_run'] = True
 
@@ -48,30 +230,52 @@ class DataDownload:
 
         end_date = timeframe_to_prev_date(self.timeframe)
         start_date = end_date - datetime.timedelta(minutes=self.back_period * timeframe_to_minutes(self.timeframe))
+        self.end_date = end_date
         self.timerange_str = f'{start_date.strftime("%Y%m%d")}-{end_date.strftime("%Y%m%d")}'
 
         self.dry_run_wallet = 1000
 
-        logger.info(f'Data download instantiated for {self.name}, timerange {self.timerange_str}')
+        # Incremental mode fetches missing candles only instead of the whole back period
+        self.incremental = self.config.get('incremental_download', True)
+        self.downloader = downloader or (incremental_download if self.incremental else start_download_data)
+        self.download_workers = self.config.get('download_workers', 4)
+        self.download_retries = self.config.get('download_retries', 3)
+        self.download_backoff = self.config.get('download_backoff', 2.0)
+        self.failed_pairs = []
 
-    def _download_data(self, download_args):
-        try:
-            start_download_data(download_args)
-        except Exception as e:
-            logger.error(f"Data download: {e}")
-            return False
-        return True
+        # Convert downloaded candles for other commands once
+        self.candle_cache = CandleCache(self.config['user_data_dir'], self.data_dir,
+                                        self.config.get('dataformat_ohlcv', 'json')) \
+            if self.config.get('candle_cache', True) else None
+
+        # Pairs downloaded up to the last closed candle, so a rerun resumes the missing pairs only
+        self.storage = ModelStorage(self.config['user_data_dir'])
+        self.checkpoint_key = f'{self.bot_name}.download_checkpoint'
+        self.checkpoint = self.storage.load(self.checkpoint_key)
+
+        logger.info(f'Data download instantiated for {self.name}, timerange {self.timerange_str}')
 
     def pair_trades_filename(self, datadir: Path, pair: str) -> Path:
-        file_extension = 'json.gz'
-        pair_s = pair_to_filename(pair)
-        filename = datadir.joinpath(f'{pair_s}-trades.{file_extension}')
-        return filename
+        return pair_trades_filename(datadir, pair)
+
+    def pending_pairs(self) -> List[str]:
+        """
+        Pairs not downloaded yet up to the last closed candle according to checkpoint
+        """
+        return [pair for pair in self.pair_list
+                if self.checkpoint.get(pair, {}).get('last_candle') != self.end_date.isoformat()]
+
+    def save_checkpoint(self) -> None:
+        self.storage.save(self.checkpoint_key, self.checkpoint)
 
     def load_data(self):
         """
         Download market data for selected timerange
         """
+        with metrics.stage('data_load', bot=self.bot_name):
+            return self._load_data()
+
+    def _load_data(self):
 
         logger.info(f'Start data download for {self.name} time range {self.timerange_str}')
         download_args = {
@@ -83,28 +287,35 @@ class DataDownload:
             'dry_run_wallet': 1000,
         }
 
-        for pair in self.pair_list:
-
-            download_args.update({'pairs': [pair]})
+        pairs = self.pending_pairs()
+        if len(pairs) < len(self.pair_list):
+            logger.info(f'Resuming data download, {len(self.pair_list) - len(pairs)} pairs already downloaded')
 
-            if not self._download_data(download_args):
+        self.failed_pairs = []
+        with ProcessPoolExecutor(max_workers=self.download_workers) as executor:
+            futures = {}
+            for pair in pairs:
+                pair_args = dict(download_args, pairs=[pair])
+                futures[executor.submit(download_pair, self.downloader, pair_args,
+                                        self.pair_trades_filename(Path(self.data_dir), pair),
+                                        self.download_retries, self.download_backoff)] = pair
 
-                data_file_name = self.pair_trades_filename(Path(self.data_dir), pair)
-                data_downloaded = False
-                for i in range(1, 4):
-                    logger.info(
-                        f"Data download finished with error, trying to remove data file and download from scratch ({i})...")
-                    try:
-                        os.remove(data_file_name)
-                    except OSError:
-                        pass
-                    data_downloaded = self._download_data(download_args)
-                    if data_downloaded:
-                        break
+            for future in as_completed(futures):
+                pair = futures[future]
+                if future.result():
+                    self.checkpoint[pair] = {
+                        'last_candle': self.end_date.isoformat(),
+                        'downloaded': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    }
+                    self.save_checkpoint()
+                    if self.candle_cache is not None:
+                        for timeframe in self.timeframes:
+                            self.candle_cache.refresh(pair, timeframe)
+                else:
+                    self.failed_pairs.append(pair)
 
-                if not data_downloaded:
-                    # nothing helped
-                    # todo: exclude pair
-                    return False
+        if self.failed_pairs:
+            logger.error(f'Data download failed for {len(self.failed_pairs)} pairs, '
+                         f'excluded: {self.failed_pairs}')
 
-        return True
+        return len(self.failed_pairs) < len(pairs) or not pairs
@@ -0,0 +1,231 @@
+import json
+import logging
+import os
+import socket
+import time
+from typing import Any, Dict, List, Optional
+
+from freqtrade.data import history
+from freqtrade.data.converter import trim_dataframes
+from freqtrade.exceptions import OperationalException
+from joblib import Parallel, dump
+
+from .chopt import ContinuousHyperOpt
+from .instrumentation import metrics
+from .optimizer import ChoptHyperopt
+from .task_queue import get_task_queue
+from .utils import setup_configuration
+
+
+logger = logging.getLogger(__name__)
+
+
+def start_hyperopt_worker(args: Dict[str, Any]) -> None:
+    """
+    Start worker evaluating epochs of distributed hyperopt runs
+    :param args: Cli args from Arguments()
+    :return: None
+    """
+    logger.info('Starting hyperopt worker...')
+
+    worker = HyperoptWorker(args)
+    worker.run()
+
+
+def worker_name() -> str:
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+class DistributedHyperopt(ChoptHyperopt):
+    """
+    Hyperopt coordinator. The optimizer runs here, points asked from it are split into
+    batches, put to the task queue and evaluated by HyperoptWorker processes on other hosts
+    against their own copy of the data. Losses are told back to the optimizer as usual,
+    so best epoch, results file, warm start and early stop work as in a local run.
+    """
+
+    def __init__(self, config: Dict[str, Any], initial_params: Optional[List[Dict[str, Any]]] = None) -> None:
+        super().__init__(config, initial_params)
+        self.queue = get_task_queue(config)
+        self.batch_size = config.get('chopt_worker_batch', 4)
+        # Local processes evaluating batches not claimed by workers yet, 0 to leave all to workers
+        self.local_jobs = config.get('chopt_coordinator_jobs', 0)
+        self.poll_interval = config.get('chopt_queue_poll_interval', 0.5)
+        self.name = worker_name()
+        self.cpu_jobs = config.get('hyperopt_jobs', -1)
+
+    def get_optimizer(self, dimensions, cpu_count):
+        # start() passes the epochs per step, acquisition optimizer runs on the coordinator's cores
+        return super().get_optimizer(dimensions, self.cpu_jobs)
+
+    def start(self) -> None:
+        """
+        Epochs loop of start() asks hyperopt_jobs points per step,
+        step is chopt_distributed_epochs_per_step points evaluated by workers
+        """
+        self.cpu_jobs = self.config.get('hyperopt_jobs', -1)
+        self.config['hyperopt_jobs'] = self.config.get('chopt_distributed_epochs_per_step', 32)
+        try:
+            super().start()
+        finally:
+            self.config['hyperopt_jobs'] = self.cpu_jobs
+
+    def task_payload(self, points: List[List[Any]], epoch: int) -> Dict[str, Any]:
+        return {
+            'job': {
+                'strategy': self.config['strategy'],
+                'pairs': self.config['exchange']['pair_whitelist'],
+                'chopt_job': self.config.get('chopt_job', ''),
+                'spaces': self.config['spaces'],
+            },
+            'timerange': self.config['timerange'],
+            'dimensions': [dim.name for dim in self.dimensions],
+            'points': points,
+            'epoch': epoch,
+        }
+
+    def run_optimizer_parallel(self, parallel, asked, i) -> List[Dict[str, Any]]:
+        """
+        Evaluate asked points on workers, collect results in the asked order
+        """
+        job = self.job_label(self.config)
+        task_ids = [self.queue.put(job, self.task_payload(asked[n:n + self.batch_size], i))
+                    for n in range(0, len(asked), self.batch_size)]
+        results = {}
+
+        try:
+            with metrics.stage('hyperopt_distributed_step', job=job), \
+                    Parallel(n_jobs=max(1, self.local_jobs)) as local_parallel:
+                waiting_since = time.time()
+                while len(results) < len(task_ids):
+                    claimed = self.local_jobs and self.queue.claim(self.name, jobs=[job])
+                    if claimed:
+                        task_id, _, payload = claimed
+                        self.queue.complete(task_id, super().run_optimizer_parallel(
+                            local_parallel, payload['points'], payload['epoch']))
+
+                    finished = self.queue.collect([task_id for task_id in task_ids if task_id not in results])
+                    for task_id, res in finished.items():
+                        if 'error' in res:
+                            raise OperationalException(f'Hyperopt task of {job} failed: {res["error"]}')
+                        results[task_id] = res['result']
+
+                    if not claimed and not finished:
+                        if time.time() - waiting_since > 60:
+                            logger.info(f'Waiting for workers, {len(task_ids) - len(results)} '
+                                        f'of {len(task_ids)} batches of {job} left')
+                            waiting_since = time.time()
+                        time.sleep(self.poll_interval)
+        except BaseException:
+            self.queue.cancel(task_ids)
+            raise
+
+        return [val for task_id in task_ids for val in results[task_id]]
+
+
+class WorkerHyperopt(ChoptHyperopt):
+    """
+    Hyperopt evaluating points of a coordinator on data of this host
+    """
+
+    def __init__(self, config: Dict[str, Any]) -> None:
+        super().__init__(config)
+        # Don't overwrite data file of a coordinator running on the same host
+        self.data_pickle_file = self.data_pickle_file.with_name(
+            f'{self.data_pickle_file.stem}_worker_{os.getpid()}.pkl')
+        self.prepared_timerange = None
+
+    def prepare_data(self, timerange: str) -> None:
+        """
+        Load data and calculate indicators like start() does before the epochs loop
+        """
+        self.config['timerange'] = timerange
+        self.init_spaces()
+
+        data, bt_timerange = self.backtesting.load_bt_data()
+        preprocessed = self.backtesting.strategy.advise_all_indicators(data)
+        processed = trim_dataframes(preprocessed, bt_timerange, self.backtesting.required_startup)
+        self.min_date, self.max_date = history.get_timerange(processed)
+        dump(preprocessed, self.data_pickle_file)
+
+        self.prepared_timerange = timerange
+        logger.info(f'Worker data prepared from {self.min_date} up to {self.max_date}')
+
+
+class HyperoptWorker:
+    """
+    Takes epoch batches of distributed hyperopt runs (chopt_distributed) from the task queue
+    and sends losses back. Config files of the worker provide exchange, data location and queue,
+    strategy, pairs and timerange come with the task.
+    """
+
+    def __init__(self, args: Dict[str, Any]) -> None:
+        self.config_files = args['config']
+        self.config = setup_configuration(args)
+        self.queue = get_task_queue(self.config)
+        self.hyperopt_jobs = args.get('hyperopt_jobs') or self.config.get('hyperopt_jobs', os.cpu_count() or 1)
+        self.poll_interval = self.config.get('chopt_queue_poll_interval', 0.5)
+        self.name = worker_name()
+        self.hyperopts: Dict[str, WorkerHyperopt] = {}
+
+    def get_hyperopt(self, job: Dict[str, Any], timerange: str) -> WorkerHyperopt:
+        """
+        Hyperopt instance of the job, kept between tasks with data prepared for timerange
+        """
+        key = json.dumps(job, sort_keys=True)
+        hyperopt = self.hyperopts.get(key)
+        if hyperopt is None:
+            chopt = ContinuousHyperOpt({
+                'config': self.config_files,
+                'strategy': job['strategy'],
+                'pairs': job['pairs'],
+                'chopt_job': job['chopt_job'],
+                'chopt_per_pair': False,
+            })
+            config = chopt.build_hyperopt_config(epochs=0)
+            config['spaces'] = job['spaces']
+            config['hyperopt_jobs'] = self.hyperopt_jobs
+            hyperopt = WorkerHyperopt(config)
+            self.hyperopts[key] = hyperopt
+
+        if hyperopt.prepared_timerange != timerange:
+            with metrics.stage('hyperopt_worker_prepare', strategy=job['strategy']):
+                hyperopt.prepare_data(timerange)
+        return hyperopt
+
+    def evaluate(self, payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+        hyperopt = self.get_hyperopt(payload['job'], payload['timerange'])
+        dimensions = [dim.name for dim in hyperopt.dimensions]
+        if dimensions != payload['dimensions']:
+            raise OperationalException(f'Search space {dimensions} differs from coordinator\'s '
+                                       f'{payload["dimensions"]}, strategy versions differ')
+
+        with Parallel(n_jobs=self.hyperopt_jobs) as parallel:
+            return hyperopt.run_optimizer_parallel(parallel, payload['points'], payload['epoch'])
+
+    def run_once(self) -> bool:
+        """
+        Evaluate one task
+        :return: False if queue is empty
+        """
+        task = self.queue.claim(self.name)
+        if task is None:
+            return False
+
+        task_id, job, payload = task
+        try:
+            with metrics.stage('hyperopt_worker_task', job=job):
+                results = self.evaluate(payload)
+        except Exception as e:
+            logger.exception(f'Hyperopt task of {job} failed: {e}')
+            self.queue.fail(task_id, f'{self.name}: {e}')
+        else:
+            self.queue.complete(task_id, results)
+            logger.info(f'Evaluated {len(results)} epochs of {job}')
+        return True
+
+    def run(self) -> None:
+        logger.info(f'Hyperopt worker {self.name} with {self.hyperopt_jobs} jobs is waiting for tasks')
+        while True:
+            if not self.run_once():
+                time.sleep(self.poll_interval)
@@ -0,0 +1,113 @@
+import hashlib
+import inspect
+import logging
+import os
+import pickle
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import numpy as np
+import pandas as pd
+from freqtrade.misc import pair_to_filename
+
+from .candle_cache import OHLCV_COLUMNS, datadir_key
+from .instrumentation import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+def strategy_code_hash(strategy) -> str:
+    """
+    Hash of strategy class source code, changes whenever strategy is edited
+    """
+    try:
+        source = inspect.getsource(type(strategy))
+    except (OSError, TypeError):
+        source = getattr(strategy, '__source__', type(strategy).__name__)
+    return hashlib.sha1(source.encode()).hexdigest()
+
+
+class IndicatorCache:
+    """
+    Cache of precomputed indicator dataframes per (strategy, exchange, data directory, pair, timeframe).
+    Sliding window runs compute indicators for newly appended candles only,
+    cache is used only if its candles are the same as the new ones where they overlap.
+    """
+
+    def __init__(self, root_folder, strategy, datadir, exchange: str = '') -> None:
+        self.strategy = strategy
+        self.code_hash = strategy_code_hash(strategy)
+        self.root = Path(root_folder, 'chopt_cache', 'indicators', type(strategy).__name__,
+                         f'{exchange}-{datadir_key(datadir)}' if exchange else datadir_key(datadir))
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+        self.startup_candles = getattr(strategy, 'startup_candle_count', 0)
+
+    def cache_path(self, pair: str, timeframe: str) -> Path:
+        return self.root.joinpath(f'{pair_to_filename(pair)}-{timeframe}.pkl')
+
+    def _load(self, path: Path) -> Optional[pd.DataFrame]:
+        try:
+            with path.open('rb') as f:
+                cached = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if cached.get('code_hash') != self.code_hash:
+            return None
+        return cached['df']
+
+    def _save(self, path: Path, df: pd.DataFrame) -> None:
+        tmp_path = path.with_suffix('.tmp')
+        with tmp_path.open('wb') as f:
+            pickle.dump({'code_hash': self.code_hash, 'df': df}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def same_candles(cached: pd.DataFrame, df: pd.DataFrame, start, end) -> bool:
+        """
+        Check candles of cached and new frame are the same between start and end
+        """
+        cached = cached[(cached['date'] >= start) & (cached['date'] <= end)]
+        df = df[(df['date'] >= start) & (df['date'] <= end)]
+        return (len(cached) == len(df)
+                and np.array_equal(cached['date'].values, df['date'].values)
+                and np.array_equal(cached[OHLCV_COLUMNS].to_numpy(dtype=np.float64),
+                                   df[OHLCV_COLUMNS].to_numpy(dtype=np.float64), equal_nan=True))
+
+    def advise_indicators(self, pair: str, timeframe: str, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Populate indicators for a pair reusing cached frame from previous run
+        """
+        path = self.cache_path(pair, timeframe)
+        cached = self._load(path)
+
+        start, end = df['date'].iloc[0], df['date'].iloc[-1]
+        if (cached is not None and len(cached) and cached['date'].iloc[0] <= start <= cached['date'].iloc[-1]
+                and self.same_candles(cached, df, start, cached['date'].iloc[-1])):
+            last_cached = cached['date'].iloc[-1]
+            new_idx = df.index[df['date'] > last_cached]
+            if len(new_idx) == 0:
+                res = cached[(cached['date'] >= start) & (cached['date'] <= end)]
+            else:
+                # Recalculate new candles only, with enough history for indicators lookback
+                first_new = df.index.get_loc(new_idx[0])
+                calc_df = df.iloc[max(0, first_new - self.startup_candles):].copy()
+                calc_df = self.strategy.advise_indicators(calc_df, {'pair': pair})
+                appended = calc_df[calc_df['date'] > last_cached]
+                res = pd.concat([cached[cached['date'] >= start], appended])
+            logger.debug(f'Indicators for {pair} {timeframe}: {len(new_idx)} new candles calculated')
+            metrics.record('indicator_candles_calculated', len(new_idx), pair=pair)
+        else:
+            res = self.strategy.advise_indicators(df.copy(), {'pair': pair})
+            logger.debug(f'Indicators for {pair} {timeframe}: {len(res)} candles calculated')
+            metrics.record('indicator_candles_calculated', len(res), pair=pair)
+
+        res = res.reset_index(drop=True)
+        self._save(path, res)
+        return res.copy()
+
+    def advise_all_indicators(self, data: Dict[str, pd.DataFrame], timeframe: str) -> Dict[str, Any]:
+        with metrics.stage('indicators', strategy=type(self.strategy).__name__):
+            return {pair: self.advise_indicators(pair, timeframe, pair_data)
+                    for pair, pair_data in data.items()}
@@ -0,0 +1,124 @@
+import atexit
+import cProfile
+import json
+import logging
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+class Instrumentation:
+    """
+    Durations and counters of chopt stages.
+    With 'chopt_metrics' config every value is appended as a json line to chopt_metrics.jsonl
+    in user data dir, the file is rotated to chopt_metrics.jsonl.1 at 'chopt_metrics_max_bytes',
+    last values can be exported as Prometheus text file. Stages listed in
+    'chopt_profile_stages' / 'chopt_tracemalloc_stages' config are profiled with
+    cProfile / tracemalloc, results are saved to chopt_profiles folder.
+    """
+
+    def __init__(self) -> None:
+        self.jsonl_path: Optional[Path] = None
+        self.max_bytes = 0
+        self.prom_path: Optional[Path] = None
+        self.profile_dir: Optional[Path] = None
+        self.profile_stages = set()
+        self.tracemalloc_stages = set()
+        self.values: Dict[tuple, float] = {}
+
+    def configure(self, config: Dict[str, Any]) -> None:
+        user_data_dir = config.get('user_data_dir')
+        if not user_data_dir:
+            return
+
+        if config.get('chopt_metrics', False):
+            self.jsonl_path = Path(user_data_dir, 'chopt_metrics.jsonl')
+            self.max_bytes = config.get('chopt_metrics_max_bytes', 10 * 1024 * 1024)
+        if config.get('chopt_metrics_prometheus', False):
+            if self.prom_path is None:
+                atexit.register(self.write_prometheus)
+            self.prom_path = Path(user_data_dir, 'chopt_metrics.prom')
+        self.profile_stages = set(config.get('chopt_profile_stages', []))
+        self.tracemalloc_stages = set(config.get('chopt_tracemalloc_stages', []))
+        self.profile_dir = Path(user_data_dir, 'chopt_profiles')
+
+    def record(self, name: str, value: float, **labels) -> None:
+        """
+        Record metric value, e.g. record('storage_write_bytes', 1024, key='trend_forecast.btcusd')
+        """
+        self.values[(name, tuple(sorted(labels.items())))] = value
+        logger.debug(f'{name} {labels} {value}')
+
+        if self.jsonl_path is None:
+            return
+        line = json.dumps({'ts': time.time(), 'pid': os.getpid(), 'metric': name, 'value': value, 'labels': labels})
+        try:
+            with self.jsonl_path.open('a') as f:
+                f.write(line + '\n')
+                size = f.tell()
+            if self.max_bytes and size >= self.max_bytes:
+                os.replace(self.jsonl_path, self.jsonl_path.with_name(f'{self.jsonl_path.name}.1'))
+        except OSError as e:
+            logger.warning(f'Can not write metrics: {e}')
+
+    @contextmanager
+    def stage(self, name: str, **labels):
+        """
+        Time a stage, records '<name>_seconds' metric
+        """
+        profiler = None
+        if name in self.profile_stages:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        trace = name in self.tracemalloc_stages and not tracemalloc.is_tracing()
+        if trace:
+            tracemalloc.start()
+
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(f'{name}_seconds', time.perf_counter() - started, **labels)
+
+            if trace:
+                current, peak = tracemalloc.get_traced_memory()
+                snapshot = tracemalloc.take_snapshot()
+                tracemalloc.stop()
+                self.record(f'{name}_peak_memory_bytes', peak, **labels)
+                self._save_profile(name, labels, 'tracemalloc.txt', lambda path: path.write_text(
+                    '\n'.join(str(stat) for stat in snapshot.statistics('lineno')[:50])))
+            if profiler is not None:
+                profiler.disable()
+                self._save_profile(name, labels, 'prof', lambda path: profiler.dump_stats(str(path)))
+
+    def _save_profile(self, name: str, labels: Dict[str, Any], extension: str, dump) -> None:
+        if self.profile_dir is None:
+            return
+        os.makedirs(self.profile_dir, exist_ok=True)
+        suffix = '-'.join(str(v).replace('/', '') for v in labels.values())
+        path = self.profile_dir.joinpath(f'{name}{"-" + suffix if suffix else ""}-{int(time.time())}.{extension}')
+        dump(path)
+        logger.info(f'Profile of {name} saved to {path}')
+
+    def write_prometheus(self) -> None:
+        """
+        Write last values of metrics recorded by this process in Prometheus text format
+        """
+        if self.prom_path is None or not self.values:
+            return
+        lines = []
+        for (name, labels), value in sorted(self.values.items()):
+            label_str = ','.join(f'{k}="{v}"' for k, v in labels)
+            lines.append(f'chopt_{name}{{{label_str}}} {value}')
+        tmp_path = self.prom_path.with_name(f'{self.prom_path.name}.{os.getpid()}.tmp')
+        tmp_path.write_text('\n'.join(lines) + '\n')
+        os.replace(tmp_path, self.prom_path)
+
+
+metrics = Instrumentation()
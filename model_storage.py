@@ -1,43 +1,364 @@
 import os
+import json
 import logging
-from typing import Any, Dict
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
 from pathlib import Path
-from pickledb import PickleDB
+
+import numpy as np
+import rapidjson
+
+from .instrumentation import metrics
 
 
 logger = logging.getLogger(__name__)
 
 
 class ModelStorage:
+    """
+    Key-value storage of chopt outputs (params, trend forecasts, position sizes).
+    Values are dicts, stored in a single SQLite database in WAL mode, so readers
+    never see half-written values and don't block writers.
+    Keys are dotted names, e.g. 'trend_forecast.btcusd'. With json_export each key
+    is also exported to its own json file for consumers reading files directly.
+    """
+
+    db_name = 'mstorage.sqlite'
 
-    def __init__(self, root_folder):
+    def __init__(self, root_folder, json_export: bool = True):
         root_path = os.path.join(root_folder, 'mstorage')
         if not os.path.isdir(root_path):
             os.makedirs(root_path)
         self.root = root_path
+        self.db_path = os.path.join(root_path, self.db_name)
+        self.json_export = json_export
+        self._conn = None
+        self._in_transaction = False
+        self._pending_exports = {}
+        # Series files to remove after commit (replaced generations) or after rollback (new generations)
+        self._pending_removals = []
+        self._rollback_removals = []
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_conn'] = None
+        return state
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS models ('
+                               'key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+                               'version INTEGER NOT NULL, updated REAL NOT NULL)')
+        return self._conn
 
     def key_to_path(self, key: str):
         folders = key.split('.')
-        prev_path = ''
-        for folder in folders[:-1]:
-            prev_path = os.path.join(prev_path, folder)
-            folder_path = os.path.join(self.root, prev_path)
-            if not os.path.isdir(folder_path):
-                os.makedirs(folder_path)
+        folder_path = os.path.join(self.root, *folders[:-1])
+        os.makedirs(folder_path, exist_ok=True)
+        return os.path.join(folder_path, f'{folders[-1]}.json')
 
-        return os.path.join(self.root, prev_path, f'{folders[-1]}.json')
+    @contextmanager
+    def transaction(self):
+        """
+        Atomic commit of all saves made within the context
+        """
+        if self._in_transaction:
+            yield self
+            return
+
+        self.conn.execute('BEGIN IMMEDIATE')
+        self._in_transaction = True
+        try:
+            yield self
+            # Json files are exported while the write lock is held,
+            # so a concurrent writer can't replace them with older values
+            for key, value in self._pending_exports.items():
+                self._export(key, value)
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            self._remove_files(self._rollback_removals)
+            raise
+        else:
+            self.conn.execute('COMMIT')
+            # Replaced series files are removed only for committed values
+            self._remove_files(self._pending_removals)
+        finally:
+            self._in_transaction = False
+            self._pending_exports = {}
+            self._pending_removals = []
+            self._rollback_removals = []
+
+    @staticmethod
+    def _remove_files(paths: List[str]) -> None:
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
 
     def save(self, key, value):
-        if not isinstance(value, dict):
-            raise ValueError(f"Value must be a dictionary to save it in model storage.")
-        db = PickleDB(self.key_to_path(key), False, True)
-        for k, v in value.items():
-            db[k] = v
-        db.dump()
+        self.save_many({key: value})
+
+    def save_many(self, items: Dict[str, Dict[str, Any]]) -> None:
+        """
+        Save several keys in one transaction
+        """
+        for key, value in items.items():
+            if not isinstance(value, dict):
+                raise ValueError(f"Value must be a dictionary to save it in model storage.")
+
+        started = time.perf_counter()
+        dumped = {key: json.dumps(value) for key, value in items.items()}
+        now = time.time()
+        with self.transaction():
+            self.conn.executemany(
+                'INSERT INTO models (key, value, version, updated) VALUES (?, ?, 1, ?) '
+                'ON CONFLICT(key) DO UPDATE SET value = excluded.value, '
+                'version = models.version + 1, updated = excluded.updated',
+                [(key, value, now) for key, value in dumped.items()])
+            if self.json_export:
+                self._pending_exports.update(dumped)
+
+        metrics.record('storage_write_seconds', time.perf_counter() - started, keys=len(dumped))
+        metrics.record('storage_write_bytes', sum(len(value) for value in dumped.values()), keys=len(dumped))
+
+    def _export(self, key: str, value: str) -> None:
+        path = self.key_to_path(key)
+        folder, name = os.path.split(path)
+        tmp_path = os.path.join(folder, f'.{name}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp')
+        try:
+            with open(tmp_path, 'w') as f:
+                f.write(value)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            # Json files are copies for file readers, database value is committed anyway
+            logger.warning(f'Can not export {key} to {path}: {e}')
+            self._remove_files([tmp_path])
 
     def load(self, key):
-        pdb = PickleDB(self.key_to_path(key), False, True)
-        return pdb.db.copy()
+        return self.load_many([key]).get(key, {})
+
+    def load_many(self, keys: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Load several keys, missing keys are omitted
+        """
+        res = {}
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            rows = self.conn.execute(
+                f'SELECT key, value FROM models WHERE key IN ({",".join("?" * len(chunk))})', chunk)
+            for key, value in rows:
+                res[key] = rapidjson.loads(value)
+
+        # Keys saved by previous versions as json files only
+        for key in keys:
+            if key not in res:
+                legacy = self._load_legacy(key)
+                if legacy:
+                    res[key] = legacy
+        return res
+
+    def series_path(self, key: str, generation: int, column: str) -> str:
+        folders = key.split('.')
+        folder_path = os.path.join(self.root, *folders[:-1])
+        os.makedirs(folder_path, exist_ok=True)
+        return os.path.join(folder_path, f'{folders[-1]}.{generation}.{column}.bin')
+
+    def save_series(self, key: str, dates, values) -> None:
+        """
+        Save time series as int64 epoch seconds and float64 values columns.
+        If stored series is the beginning of the new one, only new points are appended,
+        otherwise series is rewritten. Series metadata is saved under the key,
+        exported json file holds the series as dict of iso date -> value.
+        """
+        dates = np.ascontiguousarray(dates, dtype=np.int64)
+        values = np.ascontiguousarray(values, dtype=np.float64)
+        if len(dates) != len(values):
+            raise ValueError(f"Dates and values of series {key} must have the same length.")
+
+        with self.transaction():
+            meta = self.load(key)
+            old_generation = None
+            rewrite = True
+            if meta.get('series'):
+                old_dates, old_values = self._read_series(key, meta)
+                length = len(old_dates)
+                if length <= len(dates) and np.array_equal(old_dates, dates[:length]) \
+                        and np.array_equal(old_values, values[:length]):
+                    rewrite = False
+                    if length == len(dates):
+                        return
+                    for column, arr in (('dates', dates), ('values', values)):
+                        # Overwrite from committed length, tail of a failed write is dropped
+                        with open(self.series_path(key, meta['generation'], column), 'r+b') as f:
+                            f.seek(length * arr.itemsize)
+                            f.write(arr[length:].tobytes())
+                            f.truncate()
+                else:
+                    old_generation = meta['generation']
+                    meta['generation'] += 1
+            else:
+                meta = {'series': True, 'generation': 1}
+
+            if rewrite:
+                for column, arr in (('dates', dates), ('values', values)):
+                    path = self.series_path(key, meta['generation'], column)
+                    with open(path, 'wb') as f:
+                        f.write(arr.tobytes())
+                    self._rollback_removals.append(path)
+
+            # Readers may still map files of the old generation until the outermost transaction commits
+            if old_generation is not None:
+                self._pending_removals += [self.series_path(key, old_generation, column)
+                                           for column in ('dates', 'values')]
+
+            meta['length'] = len(dates)
+            meta['start'] = int(dates[0]) if len(dates) else None
+            meta['end'] = int(dates[-1]) if len(dates) else None
+            self.save(key, meta)
+
+            if self.json_export:
+                # Json file keeps the format of previous versions, dict of iso date -> value
+                legacy = dict(zip(np.datetime_as_string(dates.astype('datetime64[s]')).tolist(), values.tolist()))
+                self._pending_exports[key] = json.dumps(legacy)
+
+    def _read_series(self, key: str, meta: Dict[str, Any], last_n: Optional[int] = None):
+        length = meta['length']
+        start = max(0, length - last_n) if last_n is not None else 0
+        if length - start <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+        res = []
+        for column, dtype in (('dates', np.int64), ('values', np.float64)):
+            arr = np.memmap(self.series_path(key, meta['generation'], column), dtype=dtype, mode='r',
+                            shape=(length,))
+            res.append(arr[start:])
+        return tuple(res)
+
+    def load_series(self, key: str, last_n: Optional[int] = None):
+        """
+        Load time series saved with save_series, memory-mapped, no data is copied
+        :param last_n: load last n points only
+        :return: (int64 epoch seconds array, float64 values array)
+        """
+        for _ in range(3):
+            meta = self.load(key)
+            if not meta.get('series'):
+                break
+            try:
+                return self._read_series(key, meta, last_n)
+            except FileNotFoundError:
+                # Series has been rewritten since metadata was read
+                continue
+
+        if meta and not meta.get('series'):
+            # Series saved by previous versions as dict of iso date -> value
+            dates = np.array(list(meta.keys()), dtype='datetime64[s]').astype(np.int64)
+            values = np.array(list(meta.values()), dtype=np.float64)
+            if last_n is not None:
+                dates, values = dates[-last_n:], values[-last_n:]
+            return dates, values
+
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+    def _load_legacy(self, key: str) -> Dict[str, Any]:
+        path = Path(self.root, *key.split('.')[:-1], f'{key.split(".")[-1]}.json')
+        if not path.is_file():
+            return {}
+        try:
+            with path.open('r') as f:
+                return rapidjson.load(f)
+        except (OSError, ValueError):
+            logger.warning(f'Can not load {path}')
+            return {}
+
+    def keys(self, prefix: str = '') -> List[str]:
+        return list(self.versions(prefix))
+
+    def versions(self, prefix: str = '') -> Dict[str, Tuple[int, float]]:
+        """
+        Version and write timestamp of keys, payloads are not read
+        :param prefix: key prefix, e.g. 'trend_forecast.' or 'trend_forecast.*'
+        :return: dict key -> (version, updated timestamp)
+        """
+        prefix = prefix.rstrip('*')
+        rows = self.conn.execute('SELECT key, version, updated FROM models WHERE key LIKE ? ESCAPE ?',
+                                 (prefix.replace('%', '\\%').replace('_', '\\_') + '%', '\\'))
+        return {key: (version, updated) for key, version, updated in rows}
+
+    def version(self, key: str) -> Tuple[int, float]:
+        """
+        :return: (version, updated timestamp) of the key, (0, 0) if key doesn't exist
+        """
+        row = self.conn.execute('SELECT version, updated FROM models WHERE key = ?', (key,)).fetchone()
+        return row if row else (0, 0.0)
 
     def updates_since(self, key, datetime):
-        return True
+        """
+        Check if key has been updated after given time
+        :param datetime: datetime or timestamp
+        """
+        since = datetime.timestamp() if hasattr(datetime, 'timestamp') else datetime
+        return self.version(key)[1] > since
+
+    def data_version(self) -> int:
+        """
+        Changes only when another connection commits, it's cheap to poll
+        """
+        return self.conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def watch(self, prefix: str, since: Optional[Dict[str, Tuple[int, float]]] = None,
+              timeout: Optional[float] = None, poll_interval: float = 1.0) -> List[str]:
+        """
+        Block until keys with the prefix change
+        :param since: versions to compare with, as returned by versions(), current versions by default.
+                      Updated in place with the new versions when changes are found.
+        :param timeout: seconds to wait, wait forever if None
+        :return: changed keys, empty list on timeout
+        """
+        if since is None:
+            since = self.versions(prefix)
+        deadline = time.time() + timeout if timeout is not None else None
+        data_version = None
+
+        while True:
+            cur_data_version = self.data_version()
+            if cur_data_version != data_version:
+                data_version = cur_data_version
+                current = self.versions(prefix)
+                changed = [key for key, ver in current.items() if since.get(key) != ver]
+                if changed:
+                    since.clear()
+                    since.update(current)
+                    return changed
+
+            if deadline is not None and time.time() >= deadline:
+                return []
+            time.sleep(poll_interval if deadline is None else max(0.0, min(poll_interval, deadline - time.time())))
+
+    def subscribe(self, prefix: str, callback: Callable[[List[str]], Any],
+                  poll_interval: float = 1.0) -> threading.Event:
+        """
+        Call back with changed keys whenever keys with the prefix change, in a background thread
+        :return: event to set to stop the subscription
+        """
+        stop = threading.Event()
+
+        def run():
+            ms = ModelStorage(os.path.dirname(self.root), json_export=self.json_export)
+            since = ms.versions(prefix)
+            while not stop.is_set():
+                changed = ms.watch(prefix, since, timeout=poll_interval, poll_interval=poll_interval)
+                if changed:
+                    callback(changed)
+
+        threading.Thread(target=run, daemon=True).start()
+        return stop
@@ -0,0 +1,324 @@
+import logging
+import time
+from copy import deepcopy
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from freqtrade.configuration import TimeRange
+from freqtrade.data.converter import trim_dataframes
+from joblib import Parallel, delayed, wrap_non_picklable_objects
+from freqtrade.data import history
+from freqtrade.exchange import timeframe_to_seconds
+from freqtrade.optimize.hyperopt import Hyperopt
+
+from .candle_cache import CandleCache
+from .hyperopt_loss import CHOPT_LOSSES
+from .indicator_cache import IndicatorCache
+
+
+logger = logging.getLogger(__name__)
+
+
+class SeededAsk:
+    """
+    Wraps optimizer's ask() so that seeded points are handed out first.
+    Seeded points go through the regular epoch evaluation, i.e. they are
+    re-scored on the current timerange and told to the optimizer as usual.
+    """
+
+    def __init__(self, ask, seed_points: List[List[Any]]) -> None:
+        self.ask = ask
+        self.seed_points = list(seed_points)
+
+    def __call__(self, n_points=None, strategy="cl_min"):
+        if not self.seed_points:
+            return self.ask(n_points=n_points, strategy=strategy)
+
+        if n_points is None:
+            return self.seed_points.pop(0)
+
+        asked = self.seed_points[:n_points]
+        del self.seed_points[:n_points]
+        if len(asked) < n_points:
+            asked += self.ask(n_points=n_points - len(asked), strategy=strategy)
+        return asked
+
+
+class StoppingAsk:
+    """
+    Wraps optimizer's ask() to stop hyperopt when the best loss has not improved
+    by more than epsilon over the last patience epochs, or when time is over.
+    Stop is signalled with KeyboardInterrupt, which freqtrade's Hyperopt handles
+    by finishing the run with results found so far.
+    """
+
+    def __init__(self, ask, opt, patience: Optional[int], epsilon: float, deadline: Optional[float]) -> None:
+        self.ask = ask
+        self.opt = opt
+        self.patience = patience
+        self.epsilon = epsilon
+        self.deadline = deadline
+        self.stop_reason = None
+
+    def check(self) -> Optional[str]:
+        if self.deadline is not None and time.time() >= self.deadline:
+            return 'time budget'
+
+        losses = self.opt.yi
+        if self.patience and len(losses) > self.patience:
+            best_before = min(losses[:-self.patience])
+            if best_before - min(losses[-self.patience:]) <= self.epsilon:
+                return 'converged'
+        return None
+
+    def __call__(self, n_points=None, strategy="cl_min"):
+        self.stop_reason = self.check()
+        if self.stop_reason:
+            logger.info(f'Stopping hyperopt after {len(self.opt.yi)} epochs: {self.stop_reason}')
+            raise KeyboardInterrupt(self.stop_reason)
+        return self.ask(n_points=n_points, strategy=strategy)
+
+
+class ChoptHyperopt(Hyperopt):
+    """
+    Freqtrade Hyperopt with warm start from previously found parameters,
+    cached indicators between sliding window runs and vectorized loss functions
+    """
+
+    def __init__(self, config: Dict[str, Any], initial_params: Optional[List[Dict[str, Any]]] = None) -> None:
+        super().__init__(config)
+        self.initial_params = initial_params or []
+
+        # Separate data file per job, so hyperopts of different bots can run simultaneously
+        if getattr(self, 'data_pickle_file', None):
+            self.data_pickle_file = self.data_pickle_file.with_name(
+                f'hyperopt_tickerdata_{self.job_label(config)}.pkl')
+        # Per job results file, jobs of a strategy started in the same second don't share it
+        self.results_file = self.results_file.with_name(self.results_filename(config))
+
+        if config.get('indicator_cache', False):
+            strategy = self.backtesting.strategy
+            cache = IndicatorCache(config['user_data_dir'], strategy, config['datadir'], config['exchange']['name'])
+            strategy.advise_all_indicators = lambda data: cache.advise_all_indicators(data, strategy.timeframe)
+
+        if config.get('chopt_vectorized_loss', True) and config.get('hyperopt_loss') in CHOPT_LOSSES:
+            self.custom_hyperoptloss = CHOPT_LOSSES[config['hyperopt_loss']]()
+            self.custom_hyperoptloss.__class__.timeframe = str(config['timeframe'])
+            self.calculate_loss = self.custom_hyperoptloss.hyperopt_loss_function
+
+        # start() drops pairlists and closes the exchange before the epochs loop,
+        # data of later runs and validation is loaded for the whitelist captured here
+        self.whitelist = list(self.backtesting.pairlists.whitelist)
+        self.candle_cache = None
+        if config.get('candle_cache', False):
+            self.candle_cache = CandleCache(config['user_data_dir'], config['datadir'],
+                                            config.get('dataformat_ohlcv', 'json'))
+        self.backtesting.load_bt_data = self.load_bt_data
+
+    def prepare_run(self, config: Dict[str, Any], initial_params: Optional[List[Dict[str, Any]]] = None) -> None:
+        """
+        Prepare instance for another start() with new timerange, keeping strategy
+        and caches loaded. Exchange is closed by the previous start(), candles are read from data files.
+        """
+        for key in ('timerange', 'epochs', 'hyperopt_jobs'):
+            if key in config:
+                self.config[key] = config[key]
+        # Epochs loop of start() is sized by total_epochs, set from config in __init__ only
+        self.total_epochs = self.config['epochs']
+        if 'exchange' in config:
+            self.whitelist = list(config['exchange']['pair_whitelist'])
+        self.initial_params = initial_params or []
+
+        self.results_file = self.results_file.with_name(self.results_filename(self.config))
+        self.num_epochs_saved = 0
+        self.current_best_epoch = None
+        self.current_best_loss = 100
+
+    def apply_params(self, params: Dict[str, Any]) -> None:
+        """
+        Set strategy parameters and ROI table from params in .param file format
+        """
+        strategy = self.backtesting.strategy
+        for space in ('buy', 'sell'):
+            for attr_name, attr in strategy.enumerate_parameters(space):
+                if attr_name in params:
+                    attr.value = params[attr_name]
+        if 'minimal_roi' in params:
+            strategy.minimal_roi = {int(k): v for k, v in params['minimal_roi'].items()}
+
+    def backtest_loss(self, params: Dict[str, Any], processed: Dict[str, Any], min_date, max_date) -> float:
+        """
+        Loss of params backtested on preprocessed data, runs in a worker process
+        """
+        self.apply_params(params)
+        bt_results = self.backtesting.backtest(
+            processed=deepcopy(processed),
+            start_date=min_date,
+            end_date=max_date,
+            max_open_trades=self.max_open_trades,
+            position_stacking=self.position_stacking,
+            enable_protections=self.config.get('enable_protections', False),
+        )
+        results = bt_results['results']
+        return self.calculate_loss(results=results, trade_count=len(results), min_date=min_date,
+                                   max_date=max_date, config=self.config, processed=processed,
+                                   backtest_stats={})
+
+    def validation_data(self, timerange: str, validation_start: int) -> Tuple[Dict[str, Any], TimeRange]:
+        """
+        Preprocessed candles of the held-out segment. Like hyperopt data they are not trimmed,
+        startup candles before validation_start are kept and dropped by backtest().
+        :param timerange: hyperopt timerange extended by the held-out segment
+        :param validation_start: epoch seconds the held-out segment starts at
+        :return: (candles of pairs, held-out timerange)
+        """
+        hyperopt_timerange = self.config.get('timerange')
+        backtest_timerange = self.backtesting.timerange
+        self.config['timerange'] = timerange
+        try:
+            # Own loader, backtesting.pairlists is dropped by start()
+            data, data_timerange = self.load_bt_data()
+        finally:
+            self.config['timerange'] = hyperopt_timerange
+            self.backtesting.timerange = backtest_timerange
+
+        # Indicators of the hyperopt part come from indicator cache, held-out candles are appended
+        preprocessed = self.backtesting.strategy.advise_all_indicators(data)
+        start = datetime.fromtimestamp(validation_start, tz=timezone.utc)
+        processed = {}
+        for pair, df in preprocessed.items():
+            first = int(df['date'].searchsorted(start))
+            if first < len(df):
+                processed[pair] = df.iloc[max(0, first - self.backtesting.required_startup):].reset_index(drop=True)
+        return processed, TimeRange('date', data_timerange.stoptype, validation_start, data_timerange.stopts)
+
+    def validate(self, candidates: List[Dict[str, Any]], processed: Dict[str, Any],
+                 timerange: TimeRange) -> List[float]:
+        """
+        Backtest params on held-out segment in parallel
+        :param candidates: params in .param file format
+        :param processed: untrimmed held-out candles of pairs to validate on, from validation_data()
+        :param timerange: held-out timerange, from validation_data()
+        :return: loss of each candidate, empty if there are no held-out candles
+        """
+        trimmed = trim_dataframes(processed, timerange, self.backtesting.required_startup)
+        if not trimmed:
+            return []
+        min_date, max_date = history.get_timerange(trimmed)
+        logger.info(f'Validating {len(candidates)} param sets on {len(trimmed)} pairs '
+                    f'from {min_date} up to {max_date}')
+
+        # backtest() trims candles by backtesting.timerange, which is the hyperopt timerange
+        backtest_timerange = self.backtesting.timerange
+        self.backtesting.timerange = timerange
+        try:
+            with Parallel(n_jobs=min(len(candidates), self.config.get('hyperopt_jobs', 1))) as parallel:
+                losses = parallel(delayed(wrap_non_picklable_objects(self.backtest_loss))(
+                    params, processed, min_date, max_date) for params in candidates)
+        finally:
+            self.backtesting.timerange = backtest_timerange
+        return list(losses)
+
+    def load_bt_data(self):
+        """
+        Backtesting.load_bt_data for the captured whitelist, reading candles from the shared
+        candle cache if enabled. Sets backtesting.timerange to the loaded timerange.
+        """
+        backtesting = self.backtesting
+        timerange = TimeRange.parse_timerange(None if self.config.get('timerange') is None
+                                              else str(self.config.get('timerange')))
+        if self.candle_cache is not None:
+            data = self.candle_cache.load_data(pairs=self.whitelist, timeframe=backtesting.timeframe,
+                                               timerange=timerange, startup_candles=backtesting.required_startup)
+        else:
+            data = history.load_data(datadir=self.config['datadir'], pairs=self.whitelist,
+                                     timeframe=backtesting.timeframe, timerange=timerange,
+                                     startup_candles=backtesting.required_startup, fail_without_data=True,
+                                     data_format=self.config.get('dataformat_ohlcv', 'json'))
+
+        min_date, max_date = history.get_timerange(data)
+        logger.info(f'Loading data from {min_date.strftime("%Y-%m-%d %H:%M:%S")} '
+                    f'up to {max_date.strftime("%Y-%m-%d %H:%M:%S")} '
+                    f'({(max_date - min_date).days} days).')
+
+        # Adjust startts forward if not enough data is available
+        timerange.adjust_start_if_necessary(timeframe_to_seconds(backtesting.timeframe),
+                                            backtesting.required_startup, min_date)
+        # backtest() trims candles by backtesting.timerange, set once in Backtesting.__init__.
+        # Like freqtrade's load_bt_data, keep it in sync so kept-alive instances follow the sliding window
+        backtesting.timerange = timerange
+        return data, timerange
+
+    @staticmethod
+    def job_label(config: Dict[str, Any]) -> str:
+        label = f"{config.get('bot_name', 'bot')}_{config['strategy']}"
+        if config.get('chopt_job'):
+            label += f"_{config['chopt_job']}"
+        return label
+
+    @classmethod
+    def results_filename(cls, config: Dict[str, Any]) -> str:
+        return f'strategy_{cls.job_label(config)}_{datetime.now().strftime("%Y-%m-%d_%H-%M-%S")}.fthypt'
+
+    @staticmethod
+    def get_lock_filename(config: Dict[str, Any]) -> str:
+        """
+        Lock per bot and strategy instead of freqtrade's global hyperopt lock
+        """
+        return str(Path(config['user_data_dir'], f'hyperopt_{ChoptHyperopt.job_label(config)}.lock'))
+
+    def params_to_point(self, dimensions, params_dict: Dict[str, Any]) -> Optional[List[Any]]:
+        """
+        Convert params dict of a previous epoch to a point in the current search space
+        :return: point or None if params don't fit the space (strategy has been changed)
+        """
+        point = []
+        for dim in dimensions:
+            if dim.name not in params_dict:
+                return None
+            val = params_dict[dim.name]
+            if val not in dim:
+                return None
+            point.append(val)
+        return point
+
+    def get_optimizer(self, dimensions, cpu_count):
+        opt = super().get_optimizer(dimensions, cpu_count)
+
+        seed_points = []
+        for params_dict in self.initial_params:
+            point = self.params_to_point(dimensions, params_dict)
+            if point is not None and point not in seed_points:
+                seed_points.append(point)
+
+        if seed_points:
+            logger.info(f'Warm start: {len(seed_points)} of {len(self.initial_params)} '
+                        f'previous points will be re-scored first')
+            opt.ask = SeededAsk(opt.ask, seed_points)
+
+        time_budget = self.config.get('hyperopt_time_budget')
+        self.stopper = StoppingAsk(opt.ask, opt,
+                                   patience=self.config.get('early_stop_patience'),
+                                   epsilon=self.config.get('early_stop_epsilon', 0.0),
+                                   deadline=self.run_started + time_budget if time_budget else None)
+        opt.ask = self.stopper
+
+        return opt
+
+    def start(self) -> None:
+        self.run_started = time.time()
+        self.stopper = None
+        super().start()
+
+    def run_summary(self) -> Dict[str, Any]:
+        """
+        Epochs evaluated and why the run stopped
+        """
+        opt = getattr(self, 'opt', None)
+        stop_reason = self.stopper.stop_reason if self.stopper is not None else None
+        return {
+            'epochs_used': len(opt.yi) if opt is not None else 0,
+            'stop_reason': stop_reason or 'all epochs',
+            'run_time': time.time() - self.run_started,
+        }
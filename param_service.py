@@ -0,0 +1,340 @@
+import asyncio
+import fnmatch
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import rapidjson
+
+from .model_storage import ModelStorage
+from .utils import setup_configuration
+
+
+logger = logging.getLogger(__name__)
+
+# Keys read by live bots, other keys (trend models, trials, pipeline state) are not loaded
+DEFAULT_KEY_PATTERNS = ['*.param', 'pos_size_trend.*', 'trend_forecast.*']
+
+
+def start_param_service(args: Dict[str, Any]) -> None:
+    """
+    Start local service answering ModelStorage lookups of live bots
+    :param args: Cli args from Arguments()
+    :return: None
+    """
+    logger.info('Starting param service...')
+
+    config = setup_configuration(args)
+    service = ParamService(config['user_data_dir'],
+                           socket_path=config.get('param_service_socket', default_socket_path(config)),
+                           port=config.get('param_service_port'),
+                           key_patterns=config.get('param_service_keys', DEFAULT_KEY_PATTERNS))
+    service.run()
+
+
+def default_socket_path(config: Dict[str, Any]) -> str:
+    return str(Path(config['user_data_dir'], 'chopt_params.sock'))
+
+
+def match_prefix(key: str, prefix: str) -> bool:
+    return key.startswith(prefix.rstrip('*'))
+
+
+class ParamService:
+    """
+    Keeps the latest ModelStorage values in memory and answers key and prefix lookups
+    over a Unix socket, or localhost TCP when port is given. Subscribers get values
+    pushed as soon as chopt jobs commit them.
+
+    Protocol is one json object per line:
+    {"get": key} -> {"key": key, "version": int, "value": {...}}
+    {"prefix": prefix} -> {"prefix": prefix, "values": {key: {"version": int, "value": {...}}}}
+    {"series": key, "last": n} -> {"series": key, "version": int, "dates": [epoch seconds], "values": [...]}
+    {"subscribe": prefix} -> {"subscribed": prefix}, then {"update": key, "version": int, "value": {...}}
+
+    Only keys matching key_patterns are kept in memory, "last" of series requests is optional.
+    """
+
+    def __init__(self, root_folder, socket_path: Optional[str] = None, port: Optional[int] = None,
+                 host: str = '127.0.0.1', poll_interval: float = 0.1,
+                 key_patterns: Optional[List[str]] = None) -> None:
+        self.storage = ModelStorage(root_folder, json_export=False)
+        self.socket_path = socket_path
+        self.port = port
+        self.host = host
+        self.poll_interval = poll_interval
+        self.key_patterns = key_patterns if key_patterns is not None else DEFAULT_KEY_PATTERNS
+
+        # key -> (version, value encoded as json), encoded once per update
+        self.values: Dict[str, Tuple[int, str]] = {}
+        self.versions: Dict[str, Tuple[int, float]] = {}
+        # key -> (version, dates, values) of series requested since their last update
+        self.series_values: Dict[str, Tuple[int, List[int], List[float]]] = {}
+        self.data_version = None
+        self.subscribers: Dict[asyncio.StreamWriter, List[str]] = {}
+
+    def refresh(self) -> List[str]:
+        """
+        Reload values changed since the last refresh
+        :return: changed keys
+        """
+        data_version = self.storage.data_version()
+        if data_version == self.data_version:
+            return []
+        self.data_version = data_version
+
+        current = {key: ver for key, ver in self.storage.versions().items()
+                   if any(fnmatch.fnmatchcase(key, pattern) for pattern in self.key_patterns)}
+        changed = [key for key, ver in current.items() if self.versions.get(key) != ver]
+        for key, value in self.storage.load_many(changed).items():
+            self.values[key] = (current[key][0], rapidjson.dumps(value))
+        self.versions = current
+        return changed
+
+    def entry(self, key: str) -> str:
+        version, value = self.values.get(key, (0, '{}'))
+        return f'"version":{version},"value":{value}'
+
+    def series(self, key: str, last: Optional[int] = None) -> str:
+        version = self.versions[key][0] if key in self.versions else self.storage.version(key)[0]
+        cached = self.series_values.get(key)
+        if cached is None or cached[0] != version:
+            dates, values = self.storage.load_series(key)
+            cached = (version, dates.tolist(), values.tolist())
+            self.series_values[key] = cached
+
+        _, dates, values = cached
+        if last:
+            dates, values = dates[-last:], values[-last:]
+        return rapidjson.dumps({'series': key, 'version': version, 'dates': dates, 'values': values})
+
+    def respond(self, request: Dict[str, Any]) -> str:
+        if 'get' in request:
+            return f'{{"key":{json.dumps(request["get"])},{self.entry(request["get"])}}}'
+        if 'prefix' in request:
+            values = ','.join(f'{json.dumps(key)}:{{{self.entry(key)}}}'
+                              for key in self.values if match_prefix(key, request['prefix']))
+            return f'{{"prefix":{json.dumps(request["prefix"])},"values":{{{values}}}}}'
+        if 'series' in request:
+            return self.series(request['series'], request.get('last'))
+        return json.dumps({'error': f'Unknown request {request}'})
+
+    def publish(self, changed: List[str]) -> None:
+        for writer, prefixes in list(self.subscribers.items()):
+            lines = [f'{{"update":{json.dumps(key)},{self.entry(key)}}}\n' for key in changed
+                     if any(match_prefix(key, prefix) for prefix in prefixes)]
+            if lines:
+                writer.write(''.join(lines).encode())
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    writer.write(b'{"error":"Invalid request"}\n')
+                    continue
+
+                if 'subscribe' in request:
+                    self.subscribers.setdefault(writer, []).append(request['subscribe'])
+                    writer.write(f'{json.dumps({"subscribed": request["subscribe"]})}\n'.encode())
+                else:
+                    writer.write(f'{self.respond(request)}\n'.encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.subscribers.pop(writer, None)
+            writer.close()
+
+    async def watch(self) -> None:
+        while True:
+            changed = self.refresh()
+            if changed:
+                logger.debug(f'Param service: {len(changed)} keys updated')
+                self.publish(changed)
+            await asyncio.sleep(self.poll_interval)
+
+    async def serve(self) -> None:
+        self.refresh()
+        if self.port:
+            server = await asyncio.start_server(self.handle, self.host, self.port)
+            address = f'{self.host}:{self.port}'
+        else:
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            server = await asyncio.start_unix_server(self.handle, self.socket_path)
+            address = self.socket_path
+        logger.info(f'Param service listening on {address}, {len(self.values)} keys loaded')
+
+        watcher = asyncio.ensure_future(self.watch())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            watcher.cancel()
+
+    def run(self) -> None:
+        asyncio.run(self.serve())
+
+
+class ParamClient:
+    """
+    ParamService client for live bots. Values are cached in process for ttl seconds,
+    subscribed prefixes are updated as soon as the service pushes new values.
+    With storage_root, values are read from ModelStorage when the service is not running.
+    """
+
+    def __init__(self, socket_path: Optional[str] = None, port: Optional[int] = None, host: str = '127.0.0.1',
+                 ttl: float = 5.0, timeout: float = 1.0, storage_root=None) -> None:
+        self.socket_path = socket_path
+        self.port = port
+        self.host = host
+        self.ttl = ttl
+        self.timeout = timeout
+        self.storage_root = storage_root
+        self.cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+        self.series_cache: Dict[Tuple[str, Optional[int]], Tuple[float, Tuple[np.ndarray, np.ndarray]]] = {}
+        self._sock = None
+        self._file = None
+        self._lock = threading.Lock()
+        # Caches are written by the bot thread and by subscription threads
+        self._cache_lock = threading.Lock()
+
+    def _connect(self) -> socket.socket:
+        if self.port:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        else:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+        return sock
+
+    def _request(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._sock is None:
+                        self._sock = self._connect()
+                        self._file = self._sock.makefile('rb')
+                    self._sock.sendall(f'{json.dumps(request)}\n'.encode())
+                    line = self._file.readline()
+                    if line:
+                        return rapidjson.loads(line)
+                    raise ConnectionError('Param service closed connection')
+                except OSError:
+                    self.close()
+                    # Service may have been restarted, reconnect once
+                    if attempt:
+                        raise
+
+    def close(self) -> None:
+        if self._sock is not None:
+            self._sock.close()
+        self._sock = self._file = None
+
+    def _fallback(self, error: OSError) -> ModelStorage:
+        logger.warning(f'Param service is not available: {error}')
+        if self.storage_root is None:
+            raise error
+        return ModelStorage(self.storage_root, json_export=False)
+
+    def get(self, key: str) -> Dict[str, Any]:
+        cached = self.cache.get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+
+        try:
+            value = self._request({'get': key})['value']
+        except OSError as e:
+            value = self._fallback(e).load(key)
+        with self._cache_lock:
+            self.cache[key] = (time.monotonic() + self.ttl, value)
+        return value
+
+    def get_prefix(self, prefix: str) -> Dict[str, Dict[str, Any]]:
+        try:
+            values = {key: entry['value'] for key, entry in self._request({'prefix': prefix})['values'].items()}
+        except OSError as e:
+            ms = self._fallback(e)
+            values = ms.load_many(ms.keys(prefix))
+
+        expires = time.monotonic() + self.ttl
+        with self._cache_lock:
+            for key, value in values.items():
+                self.cache[key] = (expires, value)
+        return values
+
+    def get_series(self, key: str, last: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Time series saved with ModelStorage.save_series
+        :param last: last n points only
+        :return: (int64 epoch seconds array, float64 values array)
+        """
+        cached = self.series_cache.get((key, last))
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+
+        try:
+            res = self._request({'series': key, 'last': last})
+            series = np.array(res['dates'], dtype=np.int64), np.array(res['values'], dtype=np.float64)
+        except OSError as e:
+            series = self._fallback(e).load_series(key, last)
+        with self._cache_lock:
+            self.series_cache[(key, last)] = (time.monotonic() + self.ttl, series)
+        return series
+
+    def subscribe(self, prefix: str, callback: Optional[Callable[[str, Dict[str, Any]], Any]] = None,
+                  reconnect_interval: float = 5.0) -> threading.Event:
+        """
+        Keep cached values of keys with the prefix up to date with pushed updates, in a background thread
+        :param callback: called with key and new value
+        :return: event to set to stop the subscription
+        """
+        stop = threading.Event()
+
+        def run():
+            while not stop.is_set():
+                try:
+                    sock = self._connect()
+                    sock.settimeout(None)
+                    with sock, sock.makefile('rb') as f:
+                        sock.sendall(f'{json.dumps({"subscribe": prefix})}\n'.encode())
+                        for line in f:
+                            if stop.is_set():
+                                return
+                            message = rapidjson.loads(line)
+                            if 'update' not in message:
+                                continue
+                            with self._cache_lock:
+                                # Pushed values stay valid until the next push
+                                self.cache[message['update']] = (float('inf'), message['value'])
+                                for series_key in [series_key for series_key in self.series_cache
+                                                   if series_key[0] == message['update']]:
+                                    del self.series_cache[series_key]
+                            if callback is not None:
+                                callback(message['update'], message['value'])
+                except OSError as e:
+                    logger.warning(f'Param service subscription of {prefix} lost: {e}')
+                except Exception as e:
+                    logger.exception(f'Param service subscription of {prefix} failed: {e}')
+                # Values may be missed while disconnected
+                with self._cache_lock:
+                    for key in [key for key in self.cache if match_prefix(key, prefix)]:
+                        del self.cache[key]
+                    for series_key in [series_key for series_key in self.series_cache
+                                       if match_prefix(series_key[0], prefix)]:
+                        del self.series_cache[series_key]
+                stop.wait(reconnect_interval)
+
+        threading.Thread(target=run, daemon=True).start()
+        return stop
@@ -0,0 +1,260 @@
+import hashlib
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from copy import deepcopy
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from freqtrade.exchange import timeframe_to_prev_date
+
+from .candle_cache import CandleCache
+from .model_storage import ModelStorage
+from .utils import setup_configuration
+
+
+logger = logging.getLogger(__name__)
+
+
+def start_pipeline(args: Dict[str, Any]) -> None:
+    """
+    Run data load, trend and continuous hyperopt of bots as a dependency graph,
+    stages whose inputs haven't changed since their last successful run are skipped
+    :param args: Cli args from Arguments()
+    :return: None
+    """
+    logger.info('Starting pipeline...')
+
+    if args.get('jobs_file'):
+        from .scheduler import load_jobs
+        jobs = load_jobs(Path(args['jobs_file']))
+    else:
+        jobs = [{'config': args['config'], 'strategy': args.get('strategy'), 'backperiod': args.get('backperiod')}]
+
+    pipeline = Pipeline(jobs)
+    pipeline.run()
+
+
+def hash_of(*parts) -> str:
+    return hashlib.sha1(' '.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def config_hash(config_files: List[str]) -> str:
+    """
+    Hash of config files contents
+    """
+    sha = hashlib.sha1()
+    for path in config_files:
+        try:
+            sha.update(Path(path).read_bytes())
+        except OSError:
+            sha.update(path.encode())
+    return sha.hexdigest()
+
+
+def state_pair(key: str) -> str:
+    """
+    Pair of a per pair state key, e.g. 'trend.BTC/USD'
+    """
+    return key.split('.', 1)[1]
+
+
+def run_stage(kind: str, args: Dict[str, Any], pairs: Optional[List[str]] = None,
+              hyperopt_jobs: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Run a pipeline stage in a worker process, modules of the stage are imported here
+    :return: {'ok': bool, 'pairs': pairs processed successfully}
+    """
+    if kind == 'data_load':
+        from .data_load import DataDownload
+        dd = DataDownload(args)
+        ok = dd.load_data()
+        return {'ok': ok, 'pairs': [pair for pair in dd.pair_list if pair not in dd.failed_pairs]}
+
+    if kind == 'trend':
+        from .trend import Trend
+        results = Trend(args).run_pairs(pairs)
+        return {'ok': bool(results), 'pairs': list(results)}
+
+    if kind == 'chopt':
+        from .chopt import ContinuousHyperOpt
+        chopt = ContinuousHyperOpt(args)
+        if hyperopt_jobs:
+            chopt.hyperopt_jobs = hyperopt_jobs
+        return {'ok': chopt.run_hyperopt(), 'pairs': chopt.pair_list}
+
+    raise ValueError(f'Unknown pipeline stage {kind}')
+
+
+class Pipeline:
+    """
+    Per bot graph of stages: data_load, then trend and chopt of each strategy.
+    Inputs of a stage (config files, last closed candle, data files mtime and size,
+    strategy source, back period) are fingerprinted, fingerprints of successful runs are
+    kept in ModelStorage under '<bot>.pipeline_state'. Stages and pairs with unchanged
+    inputs are skipped. Stages of different bots, and trend and chopt stages of a bot,
+    run concurrently.
+    """
+
+    def __init__(self, jobs: List[Dict[str, Any]], workers: Optional[int] = None) -> None:
+        self.cpu_count = os.cpu_count() or 1
+        self.workers = workers or max(1, self.cpu_count // 4)
+        self.hyperopt_jobs = max(1, self.cpu_count // self.workers)
+
+        self.bots = {}
+        for job in jobs:
+            config_files = tuple(job['config'])
+            if config_files not in self.bots:
+                config = setup_configuration({'config': list(config_files)})
+                self.bots[config_files] = {'config': config, 'config_hash': config_hash(config_files),
+                                           'strategies': []}
+            if job.get('strategy'):
+                self.bots[config_files]['strategies'].append(job)
+
+        self.stages = self.build_stages()
+        logger.info(f'Pipeline: {len(self.bots)} bots, {len(self.stages)} stages, {self.workers} workers')
+
+    def build_stages(self) -> List[Dict[str, Any]]:
+        stages = []
+        for config_files, bot in self.bots.items():
+            bot_name = bot['config']['bot_name']
+            args = {'config': list(config_files)}
+            load = f'{bot_name}.data_load'
+            stages.append({'name': load, 'kind': 'data_load', 'bot': bot, 'args': args, 'deps': []})
+            stages.append({'name': f'{bot_name}.trend', 'kind': 'trend', 'bot': bot, 'args': args, 'deps': [load]})
+            for job in bot['strategies']:
+                chopt_args = {key: val for key, val in job.items() if val is not None}
+                chopt_args['config'] = list(config_files)
+                stages.append({'name': f'{bot_name}.chopt.{job["strategy"]}', 'kind': 'chopt', 'bot': bot,
+                               'args': chopt_args, 'deps': [load]})
+        return stages
+
+    def data_stats(self, bot: Dict[str, Any], pairs: List[str], datadir) -> Dict[str, str]:
+        """
+        Data file mtime and size of pairs in datadir
+        """
+        config = bot['config']
+        cache = CandleCache(config['user_data_dir'], datadir, config.get('dataformat_ohlcv', 'json'))
+        stats = {}
+        for pair in pairs:
+            stat = cache.data_file_stat(pair, config['timeframe'])
+            stats[pair] = f'{stat["mtime"]} {stat["size"]}' if stat else ''
+        return stats
+
+    def strategy_hash(self, bot: Dict[str, Any], strategy: str) -> str:
+        from freqtrade.resolvers import StrategyResolver
+        from .indicator_cache import strategy_code_hash
+
+        config = deepcopy(bot['config'])
+        config['strategy'] = strategy
+        return strategy_code_hash(StrategyResolver.load_strategy(config))
+
+    def fingerprints(self, stage: Dict[str, Any]) -> Dict[str, str]:
+        """
+        Fingerprints of stage inputs, per pair for trend
+        :return: dict state key -> fingerprint
+        """
+        bot = stage['bot']
+        config = bot['config']
+        last_candle = timeframe_to_prev_date(config['timeframe']).isoformat()
+        pairs = config['pairs']
+
+        if stage['kind'] == 'data_load':
+            return {'data_load': hash_of(bot['config_hash'], config.get('timeframes'), pairs, last_candle)}
+
+        if stage['kind'] == 'trend':
+            from .trend import trend_data_location
+            stats = self.data_stats(bot, pairs, trend_data_location(config))
+            return {f'trend.{pair}': hash_of(bot['config_hash'], stats[pair], last_candle)
+                    for pair in pairs if stats[pair]}
+
+        stats = self.data_stats(bot, pairs, config['datadir'])
+        args = stage['args']
+        return {f'chopt.{args["strategy"]}': hash_of(
+            bot['config_hash'], self.strategy_hash(bot, args['strategy']), args.get('backperiod'),
+            last_candle, sorted(stats.items()))}
+
+    def outdated(self, stage: Dict[str, Any], fingerprints: Dict[str, str]) -> Dict[str, str]:
+        """
+        Fingerprints of inputs changed since the last successful run, or whose outputs are missing
+        """
+        ms = ModelStorage(stage['bot']['config']['user_data_dir'])
+        state = ms.load(f'{stage["bot"]["config"]["bot_name"]}.pipeline_state')
+        res = {}
+        for key, fingerprint in fingerprints.items():
+            if state.get(key) != fingerprint:
+                res[key] = fingerprint
+            elif stage['kind'] == 'trend' and not ms.version(f'pos_size_trend.{state_pair(key).replace("/", "").lower()}')[0]:
+                res[key] = fingerprint
+        return res
+
+    def save_state(self, stage: Dict[str, Any], fingerprints: Dict[str, str]) -> None:
+        ms = ModelStorage(stage['bot']['config']['user_data_dir'])
+        key = f'{stage["bot"]["config"]["bot_name"]}.pipeline_state'
+        with ms.transaction():
+            state = ms.load(key)
+            state.update(fingerprints)
+            ms.save(key, state)
+
+    def submit(self, executor: ProcessPoolExecutor, stage: Dict[str, Any]):
+        """
+        :return: (future, fingerprints) or None if stage is up to date
+        """
+        fingerprints = self.outdated(stage, self.fingerprints(stage))
+        if not fingerprints:
+            logger.info(f'Pipeline stage {stage["name"]} is up to date, skipped')
+            return None
+
+        pairs = [state_pair(key) for key in fingerprints] if stage['kind'] == 'trend' else None
+        logger.info(f'Pipeline stage {stage["name"]} started' + (f' for {len(pairs)} pairs' if pairs else ''))
+        return executor.submit(run_stage, stage['kind'], stage['args'], pairs, self.hyperopt_jobs), fingerprints
+
+    def run(self) -> Dict[str, bool]:
+        """
+        :return: dict stage name -> True if stage succeeded or was up to date
+        """
+        pending = list(self.stages)
+        done = {}
+        running = {}
+
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            while pending or running:
+                for stage in [stage for stage in pending if all(dep in done for dep in stage['deps'])]:
+                    pending.remove(stage)
+                    failed_deps = [dep for dep in stage['deps'] if not done[dep]]
+                    if failed_deps:
+                        logger.error(f'Pipeline stage {stage["name"]} skipped, {failed_deps} failed')
+                        done[stage['name']] = False
+                        continue
+
+                    submitted = self.submit(executor, stage)
+                    if submitted is None:
+                        done[stage['name']] = True
+                    else:
+                        running[submitted[0]] = (stage, submitted[1], time.time())
+
+                if not running:
+                    continue
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    stage, fingerprints, started = running.pop(future)
+                    try:
+                        res = future.result()
+                    except Exception as e:
+                        logger.exception(f'Pipeline stage {stage["name"]} failed: {e}')
+                        res = {'ok': False, 'pairs': []}
+
+                    if stage['kind'] == 'trend':
+                        fingerprints = {key: fp for key, fp in fingerprints.items()
+                                        if state_pair(key) in res['pairs']}
+                    if res['ok'] and fingerprints:
+                        self.save_state(stage, fingerprints)
+                    done[stage['name']] = res['ok']
+                    logger.info(f'Pipeline stage {stage["name"]} {"finished" if res["ok"] else "failed"} '
+                                f'in {time.time() - started:.1f}s')
+
+        failed = [name for name, ok in done.items() if not ok]
+        logger.info(f'Pipeline finished {len(done)} stages, {len(failed)} failed {failed}')
+        return done
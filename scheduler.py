@@ -0,0 +1,130 @@
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+from typing import Any, Dict, List
+
+import rapidjson
+from freqtrade.exceptions import OperationalException
+
+from .chopt import ContinuousHyperOpt
+
+
+logger = logging.getLogger(__name__)
+
+
+def start_hyperopt_scheduler(args: Dict[str, Any]) -> None:
+    """
+    Start continuous hyperopt for many bots and strategies sharing the cpu cores
+    :param args: Cli args from Arguments()
+    :return: None
+    """
+    logger.info('Starting hyperopt scheduler...')
+
+    if not args.get('jobs_file'):
+        raise OperationalException('Hyperopt scheduler requires --jobs-file.')
+
+    scheduler = HyperoptScheduler(load_jobs(Path(args['jobs_file'])), cpu_count=args.get('hyperopt_jobs'))
+    scheduler.run()
+
+
+def load_jobs(path: Path) -> List[Dict[str, Any]]:
+    """
+    Load hyperopt jobs, each job is a dict of ContinuousHyperOpt args: config, strategy, backperiod
+    """
+    try:
+        with path.open('r') as file:
+            jobs = rapidjson.load(file, parse_mode=rapidjson.PM_COMMENTS | rapidjson.PM_TRAILING_COMMAS)
+    except FileNotFoundError:
+        raise OperationalException(f'File "{path}" not found!')
+
+    for job in jobs:
+        if 'strategy' not in job or 'config' not in job:
+            raise OperationalException(f'Job {job} must have "config" and "strategy".')
+        if isinstance(job['config'], str):
+            job['config'] = [job['config']]
+    return jobs
+
+
+def run_job(job: Dict[str, Any], hyperopt_jobs: int) -> Dict[str, Any]:
+    """
+    Run one continuous hyperopt job in a scheduler worker process
+    """
+    started = time.time()
+    name = f'{job["strategy"]} {job.get("chopt_job", "")}'.strip()
+    chopt = None
+    try:
+        chopt = ContinuousHyperOpt(job)
+        chopt.hyperopt_jobs = hyperopt_jobs
+        name = chopt.name
+        ok = chopt.run_hyperopt()
+    except Exception as e:
+        logger.exception(f'Hyperopt job {name} failed: {e}')
+        ok = False
+    return {
+        'name': name,
+        'job': job.get('chopt_job', ''),
+        'ok': ok,
+        'started': started,
+        'duration': time.time() - started,
+        'epochs': getattr(chopt, 'epochs_run', 0),
+    }
+
+
+class HyperoptScheduler:
+    """
+    Runs queued hyperopt jobs concurrently. The cores of the machine are split
+    between simultaneously running jobs, each job runs its epochs on its share.
+    Shares are computed when jobs are submitted from the cores left by running jobs,
+    so jobs at the end of the queue get the cores the queue no longer needs.
+    """
+
+    def __init__(self, jobs: List[Dict[str, Any]], cpu_count: int = None, jobs_per_run: int = 4) -> None:
+        self.jobs = jobs
+        self.cpu_count = cpu_count or os.cpu_count() or 1
+        self.max_running = max(1, min(len(jobs), self.cpu_count // jobs_per_run))
+        self.hyperopt_jobs = max(1, self.cpu_count // self.max_running)
+
+        logger.info(f'Hyperopt scheduler: {len(jobs)} jobs, {self.cpu_count} cores, '
+                    f'{self.max_running} simultaneous jobs with {self.hyperopt_jobs} hyperopt jobs each')
+
+    def job_cores(self, used: int, starting: int) -> int:
+        """
+        Hyperopt jobs of each of the jobs starting now
+        :param used: cores used by running jobs
+        :param starting: number of jobs starting now
+        """
+        return max(1, (self.cpu_count - used) // starting)
+
+    def run(self) -> List[Dict[str, Any]]:
+        queue = list(self.jobs)
+        enqueued = time.time()
+        results = []
+
+        with ProcessPoolExecutor(max_workers=self.max_running) as executor:
+            # future -> cores given to the job
+            running = {}
+            while queue or running:
+                starting = min(len(queue), self.max_running - len(running))
+                if starting:
+                    hyperopt_jobs = self.job_cores(sum(running.values()), starting)
+                    for _ in range(starting):
+                        running[executor.submit(run_job, queue.pop(0), hyperopt_jobs)] = hyperopt_jobs
+                        logger.info(f'Hyperopt job submitted with {hyperopt_jobs} hyperopt jobs, '
+                                    f'queue depth {len(queue)}')
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    del running[future]
+                    res = future.result()
+                    res['wait'] = res['started'] - enqueued
+                    res['epochs_per_sec'] = res['epochs'] / res['duration'] if res['duration'] else 0
+                    results.append(res)
+                    logger.info(f'Hyperopt job {res["name"]} {"finished" if res["ok"] else "failed"}: '
+                                f'waited {res["wait"]:.1f}s, took {res["duration"]:.1f}s, '
+                                f'{res["epochs_per_sec"]:.2f} epochs/sec, queue depth {len(queue)}')
+
+        failed = [res['name'] for res in results if not res['ok']]
+        logger.info(f'Hyperopt scheduler finished {len(results)} jobs, {len(failed)} failed {failed}')
+        return results
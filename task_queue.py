@@ -0,0 +1,291 @@
+import logging
+import os
+from abc import ABC, abstractmethod
+import sqlite3
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import rapidjson
+from freqtrade.exceptions import OperationalException
+
+
+logger = logging.getLogger(__name__)
+
+NUMBER_MODE = rapidjson.NM_NATIVE | rapidjson.NM_NAN
+
+# (task id, job, payload)
+Task = Tuple[str, str, Dict[str, Any]]
+
+
+def _serialize(value):
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return float(value)
+    if isinstance(value, np.bool_):
+        return bool(value)
+    return str(value)
+
+
+def dumps(value: Any) -> str:
+    return rapidjson.dumps(value, default=_serialize, number_mode=NUMBER_MODE)
+
+
+def loads(value: str) -> Any:
+    return rapidjson.loads(value, number_mode=NUMBER_MODE)
+
+
+def new_task_id() -> str:
+    # Time ordered, so tasks are claimed in the order they were put
+    return f'{time.time_ns():020d}-{uuid.uuid4().hex[:8]}'
+
+
+class TaskQueue(ABC):
+    """
+    Queue of hyperopt tasks shared by a coordinator and workers.
+    Claimed tasks not completed within lease seconds (worker died) are handed out again,
+    failed tasks are retried up to max_attempts times.
+    """
+
+    def __init__(self, path, lease: float = 600, max_attempts: int = 3) -> None:
+        self.path = Path(path)
+        self.lease = lease
+        self.max_attempts = max_attempts
+
+    @abstractmethod
+    def put(self, job: str, payload: Dict[str, Any]) -> str:
+        """
+        :return: task id
+        """
+
+    @abstractmethod
+    def claim(self, worker: str, jobs: Optional[List[str]] = None) -> Optional[Task]:
+        """
+        Take the oldest pending task
+        :param jobs: take tasks of these jobs only, any job if None
+        :return: task or None if queue is empty
+        """
+
+    @abstractmethod
+    def complete(self, task_id: str, result: Any) -> None:
+        """
+        Store result of a claimed task
+        """
+
+    @abstractmethod
+    def fail(self, task_id: str, error: str) -> None:
+        """
+        Return task to the queue, or mark it failed after max_attempts
+        """
+
+    @abstractmethod
+    def collect(self, task_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Remove finished tasks from the queue
+        :return: {task_id: {'result': ...} or {'error': ...}} of finished tasks
+        """
+
+    @abstractmethod
+    def cancel(self, task_ids: List[str]) -> None:
+        """
+        Remove tasks from the queue whatever their state
+        """
+
+
+class SQLiteTaskQueue(TaskQueue):
+    """
+    Task queue in SQLite database, for workers on the same host or sharing a (local) filesystem
+    """
+
+    def __init__(self, path, lease: float = 600, max_attempts: int = 3) -> None:
+        super().__init__(path, lease, max_attempts)
+        os.makedirs(self.path.parent, exist_ok=True)
+        self._conn = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_conn'] = None
+        return state
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS tasks ('
+                               'id TEXT PRIMARY KEY, job TEXT NOT NULL, payload TEXT NOT NULL, '
+                               'status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, '
+                               'worker TEXT, claimed REAL, result TEXT)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, job)')
+        return self._conn
+
+    def put(self, job: str, payload: Dict[str, Any]) -> str:
+        task_id = new_task_id()
+        self.conn.execute("INSERT INTO tasks (id, job, payload, status) VALUES (?, ?, ?, 'pending')",
+                          (task_id, job, dumps(payload)))
+        return task_id
+
+    def claim(self, worker: str, jobs: Optional[List[str]] = None) -> Optional[Task]:
+        now = time.time()
+        query = ("SELECT id, job, payload FROM tasks WHERE "
+                 "(status = 'pending' OR (status = 'claimed' AND claimed < ?))")
+        params = [now - self.lease]
+        if jobs is not None:
+            query += f' AND job IN ({",".join("?" * len(jobs))})'
+            params += jobs
+
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = self.conn.execute(query + ' ORDER BY id LIMIT 1', params).fetchone()
+            if row is not None:
+                self.conn.execute("UPDATE tasks SET status = 'claimed', worker = ?, claimed = ? WHERE id = ?",
+                                  (worker, now, row[0]))
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        self.conn.execute('COMMIT')
+
+        return (row[0], row[1], loads(row[2])) if row is not None else None
+
+    def complete(self, task_id: str, result: Any) -> None:
+        self.conn.execute("UPDATE tasks SET status = 'done', result = ? WHERE id = ?", (dumps(result), task_id))
+
+    def fail(self, task_id: str, error: str) -> None:
+        self.conn.execute("UPDATE tasks SET attempts = attempts + 1, result = ?, "
+                          "status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END WHERE id = ?",
+                          (dumps(error), self.max_attempts, task_id))
+
+    def collect(self, task_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        res = {}
+        for i in range(0, len(task_ids), 500):
+            chunk = task_ids[i:i + 500]
+            rows = self.conn.execute(
+                f"SELECT id, status, result FROM tasks WHERE status IN ('done', 'failed') "
+                f"AND id IN ({','.join('?' * len(chunk))})", chunk).fetchall()
+            for task_id, status, result in rows:
+                res[task_id] = {'result' if status == 'done' else 'error': loads(result)}
+        self.cancel(list(res))
+        return res
+
+    def cancel(self, task_ids: List[str]) -> None:
+        for i in range(0, len(task_ids), 500):
+            chunk = task_ids[i:i + 500]
+            self.conn.execute(f'DELETE FROM tasks WHERE id IN ({",".join("?" * len(chunk))})', chunk)
+
+
+class FileTaskQueue(TaskQueue):
+    """
+    Task queue in a folder, e.g. on a network share. A task is a json file moved
+    between <job>/pending, <job>/claimed and <job>/done folders, claims are atomic renames.
+    """
+
+    def __init__(self, path, lease: float = 600, max_attempts: int = 3) -> None:
+        super().__init__(path, lease, max_attempts)
+        os.makedirs(self.path, exist_ok=True)
+
+    def _folder(self, job: str, state: str) -> Path:
+        folder = self.path.joinpath(job, state)
+        os.makedirs(folder, exist_ok=True)
+        return folder
+
+    def _write(self, path: Path, value: Dict[str, Any]) -> None:
+        os.makedirs(path.parent, exist_ok=True)
+        tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+        tmp_path.write_text(dumps(value))
+        os.replace(tmp_path, path)
+
+    def _claimed_files(self, task_id: str) -> List[Path]:
+        return list(self.path.glob(f'*/claimed/{task_id}.*.json'))
+
+    def put(self, job: str, payload: Dict[str, Any]) -> str:
+        task_id = new_task_id()
+        self._write(self._folder(job, 'pending').joinpath(f'{task_id}.json'),
+                    {'job': job, 'payload': payload, 'attempts': 0})
+        return task_id
+
+    def requeue_stale(self) -> None:
+        """
+        Return tasks claimed longer than lease ago to pending
+        """
+        expired = time.time() - self.lease
+        for path in self.path.glob('*/claimed/*.json'):
+            task_id, claimed, _ = path.name.split('.')
+            if int(claimed) < expired:
+                try:
+                    os.rename(path, path.parent.parent.joinpath('pending', f'{task_id}.json'))
+                except OSError:
+                    pass
+
+    def claim(self, worker: str, jobs: Optional[List[str]] = None) -> Optional[Task]:
+        self.requeue_stale()
+
+        pending = []
+        for job in jobs if jobs is not None else [p.name for p in self.path.iterdir() if p.is_dir()]:
+            pending += self._folder(job, 'pending').glob('*.json')
+
+        for path in sorted(pending, key=lambda p: p.name):
+            task_id = path.stem
+            claimed = path.parent.parent.joinpath('claimed', f'{task_id}.{int(time.time())}.json')
+            os.makedirs(claimed.parent, exist_ok=True)
+            try:
+                os.rename(path, claimed)
+            except OSError:
+                # Claimed by another worker
+                continue
+            task = loads(claimed.read_text())
+            return task_id, task['job'], task['payload']
+        return None
+
+    def complete(self, task_id: str, result: Any) -> None:
+        for path in self._claimed_files(task_id):
+            self._write(path.parent.parent.joinpath('done', f'{task_id}.json'), {'result': result})
+            os.remove(path)
+
+    def fail(self, task_id: str, error: str) -> None:
+        for path in self._claimed_files(task_id):
+            task = loads(path.read_text())
+            task['attempts'] += 1
+            if task['attempts'] >= self.max_attempts:
+                self._write(path.parent.parent.joinpath('done', f'{task_id}.json'), {'error': error})
+            else:
+                self._write(path.parent.parent.joinpath('pending', f'{task_id}.json'), task)
+            os.remove(path)
+
+    def collect(self, task_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        res = {}
+        for task_id in task_ids:
+            for path in self.path.glob(f'*/done/{task_id}.json'):
+                res[task_id] = loads(path.read_text())
+                os.remove(path)
+        return res
+
+    def cancel(self, task_ids: List[str]) -> None:
+        for task_id in task_ids:
+            for path in self.path.glob(f'*/*/{task_id}*.json'):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+TASK_QUEUES = {
+    'sqlite': SQLiteTaskQueue,
+    'file': FileTaskQueue,
+}
+
+
+def get_task_queue(config: Dict[str, Any]) -> TaskQueue:
+    """
+    Task queue selected with 'chopt_queue_type' ('sqlite' or 'file') and 'chopt_queue_path' config
+    """
+    queue_type = config.get('chopt_queue_type', 'sqlite')
+    if queue_type not in TASK_QUEUES:
+        raise OperationalException(f'Unknown task queue "{queue_type}", available: {", ".join(TASK_QUEUES)}')
+
+    default_path = Path(config['user_data_dir'], 'chopt_queue.sqlite' if queue_type == 'sqlite' else 'chopt_queue')
+    return TASK_QUEUES[queue_type](config.get('chopt_queue_path', default_path),
+                                   lease=config.get('chopt_queue_lease', 600),
+                                   max_attempts=config.get('chopt_queue_max_attempts', 3))
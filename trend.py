@@ -1,14 +1,22 @@
+import hashlib
 import logging
-from typing import Any, Dict
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
 import datetime
 from pathlib import Path
+import numpy as np
 import pandas as pd
 from prophet import Prophet
+from prophet.serialize import model_from_json, model_to_json
 
 from freqtrade.exchange import timeframe_to_minutes, timeframe_to_prev_date
 from freqtrade.data.history import load_pair_history
 from .utils import setup_configuration
 from .model_storage import ModelStorage
+from .candle_cache import CandleCache
+from .instrumentation import metrics
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -21,18 +29,114 @@ def start_trend(args: Dict[str, Any]) -> None:
     :return: None
     """
     trend = Trend(args)
+    trend.run_pairs(trend.pair_list)
 
-    for pair in trend.pair_list:
-        logger.info(f'Trend for {pair}:')
-        trend.run(pair)
+
+def data_fingerprint(ts: pd.DataFrame) -> str:
+    """
+    Fingerprint of time series data the model is fitted on
+    """
+    h = hashlib.sha1(ts['ds'].to_numpy().tobytes())
+    h.update(ts['y'].to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def stan_init(m: Prophet) -> Dict[str, Any]:
+    """
+    Fitted parameters of a model as initial values for the next fit
+    """
+    res = {}
+    for pname in ['k', 'm', 'sigma_obs']:
+        res[pname] = m.params[pname][0][0]
+    for pname in ['delta', 'beta']:
+        res[pname] = m.params[pname][0]
+    return res
+
+
+def resample_ts(ts: pd.DataFrame, timeframe: str) -> pd.DataFrame:
+    """
+    Aggregate close prices to a larger timeframe, keeping timestamp of the last close in each period
+    """
+    rule = f'{timeframe_to_minutes(timeframe)}min'
+    return ts.set_index('ds', drop=False).resample(rule).last().dropna().reset_index(drop=True)
+
+
+def interpolate_trend(forecast: pd.DataFrame, ds: pd.Series) -> pd.DataFrame:
+    """
+    Interpolate trend of a resampled fit back to original timestamps, future points are kept as is
+    """
+    future = forecast[forecast['ds'] > ds.iloc[-1]]
+    target_ds = pd.concat([ds, future['ds']], ignore_index=True)
+    trend = np.interp(target_ds.astype('int64'), forecast['ds'].astype('int64'), forecast['trend'])
+    return pd.DataFrame({'ds': target_ds, 'trend': trend})
+
+
+def position_sizes(trends: pd.DataFrame, pos_pct_for_max_drawdown: float = 0.2,
+                   periods: int = 72) -> np.ndarray:
+    """
+    Position size for all pairs based on most recent trend, scaled down by trend drawdown
+    :param trends: trend series of pairs in columns, indexed by date
+    :param pos_pct_for_max_drawdown: position size at max drawdown of the trend
+    :param periods: periods to calculate trend change for
+    :return: record array with pair, pos_size and forecast_date fields
+    """
+    res = np.empty(trends.shape[1], dtype=[('pair', 'U32'), ('pos_size', 'f8'), ('forecast_date', 'M8[ns]')])
+    if trends.empty:
+        # No stored forecasts yet
+        return res[:0]
+
+    values = trends.to_numpy(dtype=float)
+    # Pairs of an outer-joined frame have missing rows, change is over the pair's own last periods values
+    pct_change = np.full(values.shape, np.nan)
+    for col in range(values.shape[1]):
+        rows = np.flatnonzero(~np.isnan(values[:, col]))
+        column = values[rows, col]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pct_change[rows[periods:], col] = column[periods:] / column[:-periods] - 1
+
+    max_drawdown = np.min(np.where(np.isnan(pct_change), np.inf, pct_change), axis=0, initial=np.inf)
+    max_drawdown = np.where(max_drawdown >= 0, -0.1, max_drawdown)
+
+    # Last row with trend value for every pair
+    last_pos = len(values) - 1 - np.argmax(~np.isnan(values[::-1]), axis=0)
+    last_pct = pct_change[last_pos, np.arange(values.shape[1])]
+
+    with np.errstate(invalid='ignore'):
+        pos_pct = np.where(last_pct < 0,
+                           1 - ((1 - pos_pct_for_max_drawdown) / np.abs(max_drawdown)) * np.abs(last_pct), 1)
+
+    res['pair'] = trends.columns
+    res['pos_size'] = np.round(pos_pct, 5)
+    res['forecast_date'] = trends.index.to_numpy()[last_pos]
+    return res
+
+
+def forecast_pair(trend, pair: str) -> Dict[str, Any]:
+    """
+    Trend forecast for a pair in a worker process, failures are isolated per pair
+    """
+    started = time.time()
+    try:
+        res = trend.forecast(pair)
+    except Exception as e:
+        logger.exception(f'Trend for {pair} failed: {e}')
+        res = None
+    return {'pair': pair, 'result': res, 'fit_time': time.time() - started}
+
+
+def trend_data_location(config: Dict[str, Any]) -> Path:
+    """
+    Folder trend reads candles from
+    """
+    return Path(config['user_data_dir'], 'data', 'kraken')
 
 
 class Trend:
 
-    def __init__(self, args: Dict[str, Any]) -> None:
+    def __init__(self, args: Dict[str, Any], config: Optional[Dict[str, Any]] = None) -> None:
         self.config_files = args['config']
         self.back_period = args.get("backperiod", 20520)   # 3 month
-        self.config = setup_configuration(args)
+        self.config = config if config is not None else setup_configuration(args)
 
         self.config['dry_run'] = True
 
@@ -48,16 +152,162 @@ class Trend:
             minutes=self.back_period * timeframe_to_minutes(self.timeframe))
         self.timerange_str = f'{self.start_date.strftime("%Y%m%d")}-{self.end_date.strftime("%Y%m%d")}'
 
-        self.data_location = Path(self.config['user_data_dir'], 'data', 'kraken')
+        self.data_location = trend_data_location(self.config)
+        self.candle_cache = CandleCache(self.config['user_data_dir'], self.data_location,
+                                        self.config.get('dataformat_ohlcv', 'json')) \
+            if self.config.get('candle_cache', True) else None
 
         self.dry_run_wallet = 1000
 
+        self.trend_workers = self.config.get('trend_workers', os.cpu_count() or 1)
+
+        self.pos_pct_for_max_drawdown = self.config.get('pos_pct_for_max_drawdown', 0.2)
+
+        # Timeframe candles are resampled to before fitting, e.g. '1h', None to fit every candle
+        self.trend_resample = self.config.get('trend_resample', None)
+
         logger.info(f'Trend instantiated for {self.name}, timerange {self.timerange_str}')
 
     def run(self, pair):
+        """
+        Calculate and save trend forecast and position size for a pair
+        """
+        res = self.forecast(pair)
+        self.save_forecasts({pair: res})
+        return True
+
+    def run_pairs(self, pairs: List[str]) -> Dict[str, Any]:
+        """
+        Forecast pairs in parallel and save all results in one batch
+        :return: forecasts of successfully processed pairs
+        """
+        results = {}
+        with ProcessPoolExecutor(max_workers=min(self.trend_workers, max(1, len(pairs)))) as executor:
+            for res in executor.map(forecast_pair, [self] * len(pairs), pairs):
+                if res['result'] is None:
+                    continue
+                results[res['pair']] = res['result']
+                logger.info(f'Trend for {res["pair"]} fitted in {res["fit_time"]:.1f}s')
+
+        failed = [pair for pair in pairs if pair not in results]
+        if failed:
+            logger.error(f'Trend failed for {len(failed)} pairs: {failed}')
+
+        self.save_forecasts(results)
+        return results
+
+    def save_forecasts(self, forecasts: Dict[str, Any]) -> None:
+        ms = ModelStorage(Path(self.config['user_data_dir']))
+
+        items = {}
+        with ms.transaction():
+            for pair, res in forecasts.items():
+                pair_label = pair.replace("/", "").lower()
+                ms.save_series(f'trend_forecast.{pair_label}', res['trend']['dates'], res['trend']['values'])
+                items[f'pos_size_trend.{pair_label}'] = res['pos_size']
+                logger.info(f'{pair} position size {res["pos_size"]["pos_size"]}')
+
+            ms.save_many(items)
+        logger.info(f'Trend and position size of {len(forecasts)} pairs saved to {ms.db_path}')
+
+    def load_candles(self, pair: str) -> pd.DataFrame:
+        if self.candle_cache is not None:
+            return self.candle_cache.load(pair, self.timeframe)
+        return load_pair_history(datadir=self.data_location, timeframe=self.timeframe, pair=pair)
+
+    def load_trends(self, pairs: List[str]) -> pd.DataFrame:
+        """
+        Stored trend forecasts of pairs as a frame with a column per pair
+        """
+        ms = ModelStorage(Path(self.config['user_data_dir']))
+        trends = {}
+        for pair in pairs:
+            dates, values = ms.load_series(f'trend_forecast.{pair.replace("/", "").lower()}')
+            if len(dates):
+                trends[pair] = pd.Series(values, index=pd.to_datetime(dates, unit='s'))
+        return pd.DataFrame(trends).sort_index()
+
+    def stored_position_sizes(self, pairs: List[str]) -> np.ndarray:
+        """
+        Position sizes recalculated from stored forecasts, no model fitting
+        """
+        return position_sizes(self.load_trends(pairs), self.pos_pct_for_max_drawdown)
+
+    def fit_model(self, pair: str, ts: pd.DataFrame) -> Prophet:
+        """
+        Fit Prophet model warm-started from the model fitted last time for the pair.
+        Fit is skipped if data haven't changed since then.
+        """
+        ms = ModelStorage(Path(self.config['user_data_dir']))
+        storage_key = f'trend_model.{pair.replace("/", "").lower()}'
+        fingerprint = data_fingerprint(ts)
+
+        prev = ms.load(storage_key)
+        prev_model = model_from_json(prev['model']) if prev.get('model') else None
+
+        if prev_model is not None and prev.get('fingerprint') == fingerprint:
+            logger.info(f'Data for {pair} not changed since last fit, fitted model reused')
+            return prev_model
+
+        m = Prophet(changepoint_prior_scale=1.0, changepoint_range=1.0)
+        with metrics.stage('trend_fit', pair=pair):
+            if prev_model is not None:
+                m.fit(ts, init=stan_init(prev_model))
+                logger.info(f'Model fitted from previous parameters and ready to predict')
+            else:
+                m.fit(ts)
+                logger.info(f'Model fitted and ready to predict')
+
+        ms.save(storage_key, {'fingerprint': fingerprint, 'model': model_to_json(m)})
+        return m
+
+    def benchmark_resample(self, pair: str, timeframes: List[str] = ('1h', '4h')) -> List[Dict[str, Any]]:
+        """
+        Compare fit time and trend error of resampled fits against the full resolution fit
+        :return: list of dicts with timeframe, points, fit_time and trend error
+        """
+        hist_df = self.load_candles(pair)
+        hist_df = hist_df.set_index('date', drop=False)[self.start_date:self.end_date]
+        ts = pd.DataFrame({'ds': pd.to_datetime(hist_df['date']).dt.tz_localize(None), 'y': hist_df['close']})
+        ts = ts.reset_index(drop=True)
+
+        results = []
+        full_trend = None
+        for timeframe in [None, *timeframes]:
+            fit_ts = resample_ts(ts, timeframe) if timeframe else ts
+            started = time.time()
+            m = Prophet(changepoint_prior_scale=1.0, changepoint_range=1.0)
+            m.fit(fit_ts)
+            fit_time = time.time() - started
+
+            forecast = interpolate_trend(m.predict(fit_ts[['ds']]), ts['ds'])
+            trend = forecast['trend'].to_numpy()
+            if full_trend is None:
+                full_trend = trend
+            error = np.abs(trend / full_trend - 1)
+
+            res = {
+                'timeframe': timeframe or self.timeframe,
+                'points': len(fit_ts),
+                'fit_time': fit_time,
+                'mean_error': float(error.mean()),
+                'max_error': float(error.max()),
+            }
+            logger.info(f'{pair} {res["timeframe"]}: {res["points"]} points fitted in {fit_time:.1f}s, '
+                        f'trend error mean {res["mean_error"] * 100:.3f}%, max {res["max_error"] * 100:.3f}%')
+            results.append(res)
+
+        return results
+
+    def forecast(self, pair) -> Dict[str, Any]:
+        """
+        Fit trend model for a pair and calculate position size, nothing is saved
+        :return: dict with 'trend' forecast (epoch seconds 'dates' and 'values' arrays) and 'pos_size'
+        """
 
         # Load historical data
-        hist_df = load_pair_history(datadir=self.data_location, timeframe=self.timeframe, pair=pair)
+        with metrics.stage('trend_data_load', pair=pair):
+            hist_df = self.load_candles(pair)
         hist_df = hist_df.set_index('date', drop=False)
         logger.info(f'Loaded {len(hist_df)} candles for {pair}')
 
@@ -78,49 +328,30 @@ class Trend:
         """
         Fit Prophet model and make prediction 
         """
-        m = Prophet(changepoint_prior_scale=1.0, changepoint_range=1.0)
-        m.fit(ts)
-        logger.info(f'Model fitted and ready to predict')
+        fit_ts = resample_ts(ts, self.trend_resample) if self.trend_resample else ts
+        if self.trend_resample:
+            logger.info(f'Resampled to {self.trend_resample}, {len(fit_ts)} points to fit')
+
+        m = self.fit_model(pair, fit_ts)
         future = m.make_future_dataframe(periods=forecast_days_ahead)
         forecast = m.predict(future)
+        if self.trend_resample:
+            forecast = interpolate_trend(forecast, ts['ds'])
         logger.info(f'Prediction made for {forecast_days_ahead} day(s)')
 
-        formatted_dct = {}
         trend_df = pd.DataFrame({'date': forecast['ds'], 'trend': forecast['trend']})
         trend_df = trend_df.set_index('date', drop=False)
-        dct = trend_df['trend'].to_dict()
-        for k, v in dct.items():
-            formatted_dct[k.isoformat()] = v
-
-        ms = ModelStorage(Path(self.config['user_data_dir']))
-
-        pair_label = pair.replace("/", "").lower()
-        storage_key = f'trend_forecast.{pair_label}'
-        ms.save(storage_key, formatted_dct)
-        logger.info(f'{pair} trend saved to {ms.key_to_path(storage_key)}')
-
-        """
-        Position size calculation
-        """
-        pos_pct_for_max_drawdown = 0.2
-
-        trend_df['pct_change'] = trend_df['trend'].pct_change(72)
-        max_drawdown = trend_df["pct_change"].min()
-        if max_drawdown >= 0:
-            max_drawdown = -0.1
-
-        trend_df['pos_pct'] = 1 - ((1 - pos_pct_for_max_drawdown) / abs(max_drawdown)) * abs(
-            trend_df[(trend_df['pct_change'] < 0)]['pct_change'])
-
-        trend_df['pos_pct'].fillna(1, inplace=True)
 
         # Position size based on most recent trend (i.e. predicted for the next day)
-        trend_tail = trend_df.tail(1).to_dict()
-        stake_coef = round(list(trend_tail['pos_pct'].values())[0], 5)
-        forecast_date = list(trend_tail['date'].values())[0].isoformat()
-
-        storage_key = f'pos_size_trend.{pair_label}'
-        ms.save(storage_key, {'pos_size': stake_coef, 'forecast_date': forecast_date})
-        logger.info(f'{pair} position size {stake_coef} saved to {ms.key_to_path(storage_key)}')
-
-        return True
+        pos_size = position_sizes(trend_df[['trend']].rename(columns={'trend': pair}),
+                                  self.pos_pct_for_max_drawdown)[0]
+        stake_coef = float(pos_size['pos_size'])
+        forecast_date = pd.Timestamp(pos_size['forecast_date']).isoformat()
+
+        return {
+            'trend': {
+                'dates': trend_df['date'].to_numpy().astype('datetime64[s]').astype(np.int64),
+                'values': trend_df['trend'].to_numpy(dtype=np.float64),
+            },
+            'pos_size': {'pos_size': stake_coef, 'forecast_date': forecast_date},
+        }
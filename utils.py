@@ -1,5 +1,7 @@
+import heapq
 import logging
-from typing import Any, Dict
+import time
+from typing import Any, Dict, List, Optional
 import rapidjson
 from pathlib import Path
 
@@ -8,20 +10,26 @@ from freqtrade.exceptions import OperationalException
 from freqtrade.misc import round_coin_value
 from freqtrade.configuration import Configuration
 
+from .instrumentation import metrics
+
 logger = logging.getLogger(__name__)
 
 
-def hyperopt_run(config: Dict[str, Any]):
+def hyperopt_run(config: Dict[str, Any], initial_params: Optional[List[Dict[str, Any]]] = None,
+                 top_trials: int = 0, hyperopt=None):
     """
     Start hyperopt script
-    :param args: Cli args from Arguments()
-    :return: None
+    :param config: Hyperopt configuration
+    :param initial_params: params dicts of previous epochs to warm start the optimizer with
+    :param top_trials: number of best epochs to return under 'top_trials' key
+    :param hyperopt: ChoptHyperopt instance of the previous run to reuse
+    :return: best epoch
     """
     # Import here to avoid loading hyperopt module when it's not used
     try:
         from filelock import FileLock, Timeout
 
-        from freqtrade.optimize.hyperopt import Hyperopt
+        from .optimizer import ChoptHyperopt as Hyperopt
     except ImportError as e:
         raise OperationalException(
             f"{e}. Please ensure that the hyperopt dependencies are installed.") from e
@@ -40,16 +48,27 @@ def hyperopt_run(config: Dict[str, Any]):
             logging.getLogger('filelock').setLevel(logging.WARNING)
 
             # Initialize backtesting object
-            hyperopt = Hyperopt(config)
-            hyperopt.start()
+            if hyperopt is None:
+                hyperopt = Hyperopt(config, initial_params)
+            else:
+                hyperopt.prepare_run(config, initial_params)
 
-            if hyperopt.results_file:
+            # Results file may be shared with previous runs, read results of this run only
+            results_offset = hyperopt.results_file.stat().st_size \
+                if hyperopt.results_file and hyperopt.results_file.is_file() else 0
 
-                with hyperopt.results_file.open('r') as f:
-                    hyperopts = [rapidjson.loads(line.rstrip()) for line in f]
-                    for r in hyperopts:
-                        if r and r['is_best']:
-                            hyperopt_res = r
+            with metrics.stage('hyperopt', strategy=config['strategy']):
+                hyperopt.start()
+
+            if hyperopt.results_file:
+                hyperopt_res = read_hyperopt_results(hyperopt.results_file, results_offset, top_trials,
+                                                     write_index=config.get('hyperopt_results_index', True))
+                if hyperopt_res:
+                    hyperopt_res.update(hyperopt.run_summary())
+                    if hyperopt_res['run_time']:
+                        metrics.record('hyperopt_epochs_per_second',
+                                       hyperopt_res['epochs_used'] / hyperopt_res['run_time'],
+                                       strategy=config['strategy'])
             else:
                 raise OperationalException(f'No hyperopt result file found.')
 
@@ -63,15 +82,76 @@ def hyperopt_run(config: Dict[str, Any]):
     return hyperopt_res
 
 
+def read_hyperopt_results(results_file: Path, offset: int = 0, top_trials: int = 0,
+                          write_index: bool = False) -> Dict[str, Any]:
+    """
+    Stream hyperopt results file and find the best epoch
+    :param results_file: hyperopt results file, one json epoch per line
+    :param offset: byte offset the run's results start at
+    :param top_trials: number of best epochs to return under 'top_trials' key
+    :param write_index: append best epoch location to the side index file
+    :return: best epoch
+    """
+    best_line = None
+    best_offset = None
+    top = []
+
+    with results_file.open('rb') as f:
+        f.seek(offset)
+        line_offset = offset
+        for line in f:
+            cur_offset = line_offset
+            line_offset += len(line)
+            if not line.strip():
+                continue
+
+            # Skip parsing of lines which are neither best nor needed for top trials
+            if not top_trials and b'"is_best":true' not in line and b'"is_best": true' not in line:
+                continue
+
+            r = rapidjson.loads(line)
+            if not r:
+                continue
+            if r['is_best']:
+                best_line, best_offset = line, cur_offset
+            if top_trials and r.get('results_metrics'):
+                heapq.heappush(top, (-r['loss'], r['current_epoch'], r['params_dict']))
+                if len(top) > top_trials:
+                    heapq.heappop(top)
+
+    if best_line is None:
+        return {}
+
+    hyperopt_res = rapidjson.loads(best_line)
+    if top_trials:
+        hyperopt_res['top_trials'] = [params for _, _, params in sorted(top, reverse=True)]
+
+    if write_index:
+        with Path(f'{results_file}.idx').open('a') as f:
+            f.write(rapidjson.dumps({
+                'start_offset': offset,
+                'end_offset': line_offset,
+                'best_offset': best_offset,
+                'best_epoch': hyperopt_res.get('current_epoch'),
+                'loss': hyperopt_res.get('loss'),
+            }) + '\n')
+
+    return hyperopt_res
+
+
 def setup_configuration(args: Dict[str, Any]) -> Dict[str, Any]:
     """
     Prepare the configuration
     :param args: Cli args from Arguments()
     :return: Configuration
     """
+    started = time.perf_counter()
     configuration = Configuration(args)
+    config = configuration.get_config()
 
-    return configuration.get_config()
+    metrics.configure(config)
+    metrics.record('config_load_seconds', time.perf_counter() - started)
+    return config
 
 
 def setup_chopt_configuration(args: Dict[str, Any]) -> Dict[str, Any]:
@@ -119,6 +199,10 @@ def human_report_hyperopt(hyperopt_res):
                  f'trades per day {trades_per_day}, ' \
                  f'avg. duration {holding_avg}, winner {winner_holding_avg}, loser {loser_holding_avg}'
 
+    if 'stop_reason' in hyperopt_res:
+        report_str += f', {hyperopt_res["epochs_used"]} epochs in {hyperopt_res["run_time"]:.0f}s, ' \
+                      f'stopped by {hyperopt_res["stop_reason"]}'
+
     return report_str
 
 